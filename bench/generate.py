@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Generate a synthetic declaration workbook in the MVD layout.
+
+Every numbered block is a declarant followed by `relatives` relatives, every
+person taking as many rows as the longest of its ownership, usage and
+vehicle lists. A `dirty` share of the values is replaced with the noise
+found in real files: dashes, "не имеет", blanks, typos and odd spacing.
+
+Example (from the repository root):
+    python3 bench/generate.py /tmp/book.xlsx -p 5000 -r 2
+"""
+
+import argparse
+import random
+
+import openpyxl
+
+HEADER = ('pp', 'name', 'position', 'income', 'own_obj', 'own_type', 'own_sq',
+          'own_location', 'use_obj', 'use_sq', 'use_loc', 'vehicle', 'vehicle_pay')
+
+SURNAMES = ('Абрамов', 'Бородин', 'Васильев', 'Горбунов', 'Данилов', 'Егоров',
+            'Жуков', 'Зайцев', 'Иванов', 'Козлов', 'Лебедев', 'Морозов')
+POSITIONS = ('Начальник управления', 'Заместитель начальника департамента',
+             'Заместитель начальника НЦБ Интерпола при МВД России',
+             'Начальник отдела', 'Главный специалист')
+RELATIVES = ('супруга', 'супруг', 'несовершеннолетний ребенок', 'несовершеннолетний ребёнок')
+OBJECTS = ('квартира', 'жилой дом', 'земельный участок', 'гараж', 'дачный участок',
+           'машино-место', 'садовый дом', 'комната')
+OWNERSHIP_TYPES = ('индивидуальная', 'совместная', 'общая долевая (1/2)', 'долевая, 1/3',
+                   'общая совместная')
+COUNTRIES = ('Россия', 'Россия', 'Россия', 'Беларусь', 'Казахстан')
+VEHICLES = ('Автомобиль легковой: Toyota RAV 4', 'Автомобили легковые: \nВАЗ 2107',
+            'Мототранспорт: Yamaha', 'Автомобиль легковой Kia Rio')
+NOISE = (' - ', '-', 'не имеет', ' ', 'нет')
+
+
+def typo(rng, text):
+    """`text` with two neighbouring letters swapped"""
+    if len(text) < 4:
+        return text
+    pos = rng.randrange(1, len(text) - 2)
+    return text[:pos] + text[pos + 1] + text[pos] + text[pos + 2:]
+
+
+def dirty_value(rng, value, dirty):
+    """`value`, or a noisy version of it in `dirty` share of the cases"""
+    if not dirty or rng.random() >= dirty:
+        return value
+    kind = rng.random()
+    if kind < 0.5:
+        return rng.choice(NOISE)
+    if isinstance(value, str):
+        if kind < 0.75:
+            return typo(rng, value)
+        return '  %s ' % (value.upper() if kind < 0.9 else value)
+    return str(value).replace('.', ',')
+
+
+def person_rows(rng, number, name, position, ownership, usage, vehicles, dirty):
+    """Rows of one person, the first one holding number, name, position and income"""
+    own = [(rng.choice(OBJECTS), rng.choice(OWNERSHIP_TYPES),
+            round(rng.uniform(10, 2000), 1), rng.choice(COUNTRIES))
+           for _ in range(rng.randint(0, ownership))]
+    use = [(rng.choice(OBJECTS), round(rng.uniform(10, 500), 1), rng.choice(COUNTRIES))
+           for _ in range(rng.randint(0, usage))]
+    veh = [(rng.choice(VEHICLES), None) for _ in range(rng.randint(0, vehicles))]
+    if not own:
+        own = [('не имеет', None, None, None)]
+    income = round(rng.uniform(0, 5000000), 2) if rng.random() > 0.1 else 'не имеет'
+    rows = []
+    for num in range(max(len(own), len(use), len(veh), 1)):
+        row = [None] * len(HEADER)
+        if num == 0:
+            row[0:4] = [number, name, position, income]
+        if num < len(own):
+            row[4:8] = own[num]
+        if num < len(use):
+            row[8:11] = use[num]
+        if num < len(veh):
+            row[11:13] = veh[num]
+        rows.append([dirty_value(rng, val, dirty) if col > 3 and val is not None else val
+                     for col, val in enumerate(row)])
+    return rows
+
+
+def generate(path, persons=1000, relatives=2, ownership=3, usage=2, vehicles=1,
+             dirty=0.05, seed=0):
+    """Write a workbook of `persons` numbered blocks with up to `relatives`
+       relatives each, and up to `ownership`, `usage` and `vehicles` items
+       per person. Return the number of rows below the header"""
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append(HEADER)
+    count = 0
+    for number in range(1, persons + 1):
+        name = '%s %s. %s.' % (rng.choice(SURNAMES), rng.choice('АБВГДЕИКЛМНОП'),
+                               rng.choice('АБВГДЕИКЛМНОП'))
+        rows = person_rows(rng, number, name, rng.choice(POSITIONS),
+                           ownership, usage, vehicles, dirty)
+        for _ in range(rng.randint(0, relatives)):
+            rows.extend(person_rows(rng, None, rng.choice(RELATIVES), '-',
+                                    ownership, usage, vehicles, dirty))
+        for row in rows:
+            sheet.append(row)
+        count += len(rows)
+    workbook.save(path)
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("xls_file", help="Output xlsx file")
+    parser.add_argument("-p", "--persons", help="Numbered blocks", type=int, default=1000)
+    parser.add_argument("-r", "--relatives", help="Max relatives per block", type=int, default=2)
+    parser.add_argument("-o", "--ownership", help="Max ownership rows per person",
+                        type=int, default=3)
+    parser.add_argument("-u", "--usage", help="Max usage rows per person", type=int, default=2)
+    parser.add_argument("-v", "--vehicles", help="Max vehicles per person", type=int, default=1)
+    parser.add_argument("-d", "--dirty", help="Share of noisy values", type=float, default=0.05)
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    ARGS = parser.parse_args()
+
+    ROWS = generate(ARGS.xls_file, ARGS.persons, ARGS.relatives, ARGS.ownership,
+                    ARGS.usage, ARGS.vehicles, ARGS.dirty, ARGS.seed)
+    print('%s: %s blocks, %s rows' % (ARGS.xls_file, ARGS.persons, ROWS))
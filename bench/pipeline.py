@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Time every stage of the xparse pipeline and track the results.
+
+The stages run one after another on a workbook, generated with
+bench/generate.py unless one is given: load_file, parse_person,
+make_blocks, map_data, dict2xml (dicttoxml2 and xschema), write of the
+xml bytes and the whole save_to_file. Each stage is timed on its own, then
+the pipeline runs again under tracemalloc for the peak memory of every
+stage. The startup, `python -c "import xparse"` run from another directory,
+is timed next to a bare `python -c pass`. A result is appended as one JSON line to `--output`, with the
+commit and the parameters, so runs of different versions can be compared.
+
+Example (from the repository root):
+    python3 bench/pipeline.py -p 5000 -o bench_results.jsonl
+    python3 bench/pipeline.py tests/test_data/test_book.xlsx
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import xparse # pylint: disable=wrong-import-position
+import xschema # pylint: disable=wrong-import-position
+from dicttoxml2 import dicttoxml2 # pylint: disable=wrong-import-position
+from generate import generate # pylint: disable=wrong-import-position,import-error
+
+
+def git_commit():
+    """Commit of the working tree, None outside of git"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def startup(repeat=5):
+    """Best of `repeat` wall times of a bare interpreter and of one
+       importing xparse, both started in an empty directory"""
+    root = os.path.join(BENCH_DIR, os.pardir)
+    env = dict(os.environ, PYTHONPATH=root)
+    results = {}
+    with tempfile.TemporaryDirectory() as cwd:
+        for name, code in (('python', 'pass'), ('xparse', 'import xparse')):
+            times = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, check=True)
+                times.append(time.perf_counter() - started)
+            results[name] = round(min(times), 4)
+    return results
+
+
+def stages(xls_file, save_dir):
+    """Yield (name, function) of the pipeline stages, every function
+       taking the result of the previous one"""
+    yield 'load_file', lambda _: xparse.load_file(xls_file, read_only=True,
+                                                  max_col=xparse.layout_max_col('A2'))
+
+    def parse(worksheet):
+        """parse_person on the loaded sheet"""
+        return xparse.Parser(worksheet).parse_person()
+    yield 'parse_person', parse
+
+    def make_blocks(data_all):
+        """make_blocks with relations"""
+        blocks = xparse.make_blocks(data_all)
+        xparse.set_relations(blocks)
+        return blocks
+    yield 'make_blocks', make_blocks
+
+    def map_data(blocks):
+        """map_data of every person, blocks kept for save_to_file"""
+        return blocks, [xparse.map_data(person) for block in blocks for person in block]
+    yield 'map_data', map_data
+
+    def dict2xml(state):
+        """Generic serializer"""
+        blocks, mapped = state
+        dicttoxml2.dict2xml(mapped, attr_type=False, item_func=xparse.parent_to_child,
+                            custom_root='persons')
+        return state
+    yield 'dict2xml', dict2xml
+
+    def schema2xml(state):
+        """Schema serializer, its output is written next"""
+        blocks, mapped = state
+        return blocks, xschema.persons2xml(mapped, 'persons', xparse.parent_to_child)
+    yield 'xschema', schema2xml
+
+    def write(state):
+        """Xml bytes to a file"""
+        blocks, xml = state
+        with open(os.path.join(save_dir, 'persons.xml'), 'wb') as fout:
+            fout.write(xml)
+        return blocks
+    yield 'write', write
+
+    yield 'save_to_file', lambda blocks: xparse.save_to_file(blocks, 0, save_dir)
+
+
+def run(xls_file, trace=False):
+    """{stage: seconds} or, with `trace`, {stage: peak bytes} of one run"""
+    results = {}
+    value = None
+    with tempfile.TemporaryDirectory() as save_dir:
+        for name, function in stages(xls_file, save_dir):
+            if trace:
+                tracemalloc.start()
+                value = function(value)
+                results[name] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                started = time.perf_counter()
+                value = function(value)
+                results[name] = time.perf_counter() - started
+            if name == 'parse_person':
+                results['persons'] = len(value)
+    return results
+
+
+def benchmark(xls_file, params=None):
+    """Result record of `xls_file`, see run"""
+    seconds = run(xls_file)
+    peaks = run(xls_file, trace=True)
+    persons = seconds.pop('persons')
+    peaks.pop('persons')
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'file': xls_file,
+        'params': params,
+        'persons': persons,
+        'stages': {name: {'seconds': round(seconds[name], 4), 'peak_bytes': peaks[name]}
+                   for name in seconds},
+        'total_seconds': round(sum(seconds.values()), 4),
+        'startup_seconds': startup(),
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def report(result):
+    """Human readable table of a result"""
+    lines = ['%-14s %10s %12s' % ('stage', 'seconds', 'peak MiB')]
+    for name, stage in result['stages'].items():
+        lines.append('%-14s %10.4f %12.1f' % (name, stage['seconds'],
+                                              stage['peak_bytes'] / 2**20))
+    lines.append('%s persons, %.2f s, max RSS %.0f MiB' % (
+        result['persons'], result['total_seconds'], result['max_rss_bytes'] / 2**20))
+    lines.append('import xparse %.3f s, bare python %.3f s' % (
+        result['startup_seconds']['xparse'], result['startup_seconds']['python']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("xls_file", help="Workbook to run on, generated if omitted", nargs='?')
+    parser.add_argument("-p", "--persons", help="Numbered blocks to generate",
+                        type=int, default=2000)
+    parser.add_argument("-r", "--relatives", help="Max relatives per block", type=int, default=2)
+    parser.add_argument("--ownership", help="Max ownership rows per person", type=int, default=3)
+    parser.add_argument("--usage", help="Max usage rows per person", type=int, default=2)
+    parser.add_argument("--vehicles", help="Max vehicles per person", type=int, default=1)
+    parser.add_argument("-d", "--dirty", help="Share of noisy values", type=float, default=0.05)
+    parser.add_argument("-o", "--output", help="JSON lines file to append the result to",
+                        type=str)
+    ARGS = parser.parse_args()
+
+    xparse.logger.setLevel(logging.ERROR)
+    if ARGS.xls_file:
+        PARAMS = None
+        RESULT = benchmark(ARGS.xls_file)
+    else:
+        PARAMS = {'persons': ARGS.persons, 'relatives': ARGS.relatives,
+                  'ownership': ARGS.ownership, 'usage': ARGS.usage,
+                  'vehicles': ARGS.vehicles, 'dirty': ARGS.dirty}
+        with tempfile.TemporaryDirectory() as TMP:
+            XLS_FILE = os.path.join(TMP, 'synthetic.xlsx')
+            PARAMS['rows'] = generate(XLS_FILE, **PARAMS)
+            RESULT = benchmark(XLS_FILE, PARAMS)
+            RESULT['file'] = None
+    print(report(RESULT))
+    if ARGS.output:
+        with open(ARGS.output, 'a') as fout:
+            fout.write(json.dumps(RESULT, sort_keys=True) + '\n')
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Memory of parsed and mapped persons as records and as the dicts and
+OrderedDicts parse_person and map_data used to return, and of the parsed
+persons as xcolumns tables.
+
+Example (from the repository root):
+    python3 bench/records.py tests/test_data/test_book.xlsx -n 100
+"""
+
+import argparse
+import copy
+import logging
+import os
+import sys
+import tracemalloc
+from collections import OrderedDict
+from collections.abc import Mapping
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import xcolumns # pylint: disable=wrong-import-position
+import xparse # pylint: disable=wrong-import-position
+
+
+def as_mappings(obj, mapping=dict):
+    """`obj` with its records turned into `mapping`s"""
+    if isinstance(obj, Mapping):
+        return mapping((key, as_mappings(value, mapping)) for key, value in obj.items())
+    if isinstance(obj, list):
+        return [as_mappings(item, mapping) for item in obj]
+    return obj
+
+
+def allocated(data, number):
+    """Bytes taken by `number` deep copies of `data`, values being shared"""
+    tracemalloc.start()
+    copies = [copy.deepcopy(data) for _ in range(number)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del copies
+    return size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("xls_file", help="Input xls file")
+    parser.add_argument("-n", "--number", help="Copies of the persons", type=int, default=100)
+    ARGS = parser.parse_args()
+
+    xparse.logger.setLevel(logging.ERROR)
+    DATA_ALL = xparse.Parser(xparse.load_file(ARGS.xls_file, read_only=True,
+                                              max_col=xparse.layout_max_col('A2'))).parse_person()
+    xparse.set_relations(xparse.iter_blocks(DATA_ALL))
+    MAPPED = [xparse.map_data(person) for person in DATA_ALL]
+
+    for NAME, DATA, MAPPING in (('parsed', DATA_ALL, dict),
+                                ('mapped', MAPPED, OrderedDict)):
+        RECORDS = allocated(DATA, ARGS.number)
+        OLD = allocated(as_mappings(DATA, MAPPING), ARGS.number)
+        print('%s: %s persons, records %.1f MiB, %ss %.1f MiB (%.0f%% less)' % (
+            NAME, len(DATA) * ARGS.number, RECORDS / 2**20, MAPPING.__name__,
+            OLD / 2**20, 100.0 * (OLD - RECORDS) / OLD))
+
+    COLUMNS = allocated(xcolumns.Declarations.from_persons(DATA_ALL), ARGS.number)
+    RECORDS = allocated(DATA_ALL, ARGS.number)
+    print('columns: %s persons, tables %.1f MiB, records %.1f MiB (%.0f%% less)' % (
+        len(DATA_ALL) * ARGS.number, COLUMNS / 2**20, RECORDS / 2**20,
+        100.0 * (RECORDS - COLUMNS) / RECORDS))
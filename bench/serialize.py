@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Time XML serialization of the persons parsed from a workbook.
+
+Example (from the repository root):
+    python3 bench/serialize.py tests/test_data/test_book.xlsx -n 5
+"""
+
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import xparse # pylint: disable=wrong-import-position
+import xschema # pylint: disable=wrong-import-position
+from dicttoxml2 import dicttoxml2, dicttoxml3 # pylint: disable=wrong-import-position
+
+
+def schema2xml(persons, attr_type=False, item_func=None, custom_root='persons'): #pylint: disable=unused-argument
+    """xschema.persons2xml with the dict2xml arguments"""
+    return xschema.persons2xml(persons, custom_root, item_func)
+
+
+SERIALIZERS = (('dicttoxml2', dicttoxml2.dict2xml),
+               ('dicttoxml3', dicttoxml3.dict2xml),
+               ('xschema', schema2xml))
+
+
+def mapped_persons(xls_file):
+    """Parse and map all persons of `xls_file`"""
+    data_all = xparse.Parser(xparse.load_file(xls_file, read_only=True,
+                                              max_col=xparse.layout_max_col('A2'))).parse_person()
+    return [xparse.map_data(person)
+            for block in xparse.iter_related(xparse.iter_blocks(data_all))
+            for person in block]
+
+
+def serialize(persons, dict2xml=dicttoxml2.dict2xml):
+    """`dict2xml` as save_to_file calls it"""
+    return dict2xml(persons, attr_type=False,
+                    item_func=xparse.parent_to_child,
+                    custom_root='persons')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("xls_file", help="Input xls file")
+    parser.add_argument("-n", "--number", help="Repeats", type=int, default=5)
+    ARGS = parser.parse_args()
+
+    xparse.logger.setLevel(logging.ERROR)
+    PERSONS = mapped_persons(ARGS.xls_file)
+    EXPECTED = serialize(PERSONS)
+    for NAME, DICT2XML in SERIALIZERS:
+        if serialize(PERSONS, DICT2XML) != EXPECTED:
+            sys.exit('%s output differs from dicttoxml2' % NAME)
+        BEST = min(timeit.repeat(lambda: serialize(PERSONS, DICT2XML), # pylint: disable=cell-var-from-loop
+                                 number=1, repeat=ARGS.number))
+        print('%s: %s persons, %s bytes, best of %s: %.4f s (%.0f persons/s)' % (
+            NAME, len(PERSONS), len(EXPECTED), ARGS.number, BEST, len(PERSONS) / BEST))
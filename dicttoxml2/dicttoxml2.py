@@ -15,10 +15,13 @@ __version__ = '1.7.4'
 version = __version__
 
 from random import randint
-import collections
+import re
+try:
+    from collections.abc import Iterable, Mapping
+except ImportError: # python 2
+    from collections import Iterable, Mapping
 import numbers
 import logging
-from xml.dom.minidom import parseString
 
 
 LOG = logging.getLogger("dicttoxml")
@@ -94,9 +97,9 @@ def get_xml_type(val):
         return 'number'
     if type(val).__name__ == 'NoneType':
         return 'null'
-    if isinstance(val, dict):
+    if isinstance(val, Mapping):
         return 'dict'
-    if isinstance(val, collections.Iterable):
+    if isinstance(val, Iterable):
         return 'list'
     return type(val).__name__
 
@@ -118,41 +121,70 @@ def make_attrstring(attr):
     return '%s%s' % (' ' if attrstring != '' else '', attrstring)
 
 
+# XML 1.0 (Fifth Edition) Name production without colons, as minidom is 
+# namespace aware; trailing whitespace is allowed in tags
+NAME_START_CHARS = ('A-Z_a-z\u00C0-\u00D6\u00D8-\u00F6\u00F8-\u02FF\u0370-\u037D'
+    '\u037F-\u1FFF\u200C-\u200D\u2070-\u218F\u2C00-\u2FEF\u3001-\uD7FF'
+    '\uF900-\uFDCF\uFDF0-\uFFFD\U00010000-\U000EFFFF')
+NAME_CHARS = NAME_START_CHARS + '\\-.0-9\u00B7\u0300-\u036F\u203F-\u2040'
+# compiled by the re cache on first use, not on import
+XML_NAME = '[%s][%s]*[ \\t\\r\\n]*\\Z' % (NAME_START_CHARS, NAME_CHARS)
+
+validate_names = True # see set_name_validation
+valid_names = {} # key -> (valid name, whether key goes to a name attribute)
+
+
+def set_name_validation(validate=True):
+    """Turns checking and fixing of element names on or off. 
+    Turn it off only for trusted schemas whose keys are valid XML names."""
+    global validate_names
+    validate_names = validate
+
+
 def key_is_valid_xml(key):
     """Checks that a key is a valid XML name"""
-    LOG.info('Inside key_is_valid_xml(). Testing "%s"' % (unicode_me(key)))
-    test_xml = '<?xml version="1.0" encoding="UTF-8" ?><%s>foo</%s>' % (key, key)
-    try:
-        parseString(test_xml)
-        return True
-    except Exception: # minidom does not implement exceptions well
-        return False
+    if LOG.isEnabledFor(logging.INFO):
+        LOG.info('Inside key_is_valid_xml(). Testing "%s"', unicode_me(key))
+    return type(key) in (str, unicode) and re.match(XML_NAME, key) is not None
 
 
-def make_valid_xml_name(key, attr):
-    """Tests an XML name and fixes it if invalid"""
-    LOG.info('Inside make_valid_xml_name(). Testing key "%s" with attr "%s"' % (
-        unicode_me(key), unicode_me(attr))
-    )
-    key = escape_xml(key)
-    attr = escape_xml(attr)
-    
+def fix_xml_name(key):
+    """Returns (name, to_attr) for an escaped key, to_attr meaning that the 
+    key does not fit and goes to a name attribute of a `key` element"""
     # pass through if key is already valid
     if key_is_valid_xml(key):
-        return key, attr
+        return key, False
         
     # prepend a lowercase n if the key is numeric
     if key.isdigit():
-        return 'n%s' % (key), attr
+        return 'n%s' % (key), False
         
     # replace spaces with underscores if that fixes the problem
     if key_is_valid_xml(key.replace(' ', '_')):
-        return key.replace(' ', '_'), attr
+        return key.replace(' ', '_'), False
         
     # key is still invalid - move it into a name attribute
-    attr['name'] = key
-    key = 'key'
-    return key, attr
+    return 'key', True
+
+
+def make_valid_xml_name(key, attr):
+    """Tests an XML name and fixes it if invalid"""
+    if LOG.isEnabledFor(logging.INFO):
+        LOG.info('Inside make_valid_xml_name(). Testing key "%s" with attr "%s"',
+            unicode_me(key), unicode_me(attr))
+    if not validate_names:
+        return key, attr
+
+    key = escape_xml(key)
+    attr = escape_xml(attr)
+    
+    try:
+        name, to_attr = valid_names[key]
+    except KeyError:
+        name, to_attr = valid_names[key] = fix_xml_name(key)
+    if to_attr:
+        attr['name'] = key
+    return name, attr
 
 
 def wrap_cdata(s):
@@ -169,7 +201,8 @@ def convert(obj, ids, attr_type, item_func, cdata, parent='root'):
     """Routes the elements of an object to the right function to convert them 
     based on their data type"""
     
-    LOG.info('Inside convert(). obj type is: "%s", obj="%s"' % (type(obj).__name__, unicode_me(obj)))
+    if LOG.isEnabledFor(logging.INFO):
+        LOG.info('Inside convert(). obj type is: "%s", obj="%s"', type(obj).__name__, unicode_me(obj))
     
     item_name = item_func(parent)
     
@@ -185,10 +218,10 @@ def convert(obj, ids, attr_type, item_func, cdata, parent='root'):
     if obj is None:
         return convert_none(item_name, '', attr_type, cdata)
         
-    if isinstance(obj, dict):
+    if isinstance(obj, Mapping):
         return convert_dict(obj, ids, parent, attr_type, item_func, cdata)
         
-    if isinstance(obj, collections.Iterable):
+    if isinstance(obj, Iterable):
         return convert_list(obj, ids, parent, attr_type, item_func, cdata)
         
     raise TypeError('Unsupported data type: %s (%s)' % (obj, type(obj).__name__))
@@ -196,18 +229,18 @@ def convert(obj, ids, attr_type, item_func, cdata, parent='root'):
 
 def convert_dict(obj, ids, parent, attr_type, item_func, cdata):
     """Converts a dict into an XML string."""
-    LOG.info('Inside convert_dict(): obj type is: "%s", obj="%s"' % (
-        type(obj).__name__, unicode_me(obj))
-    )
+    if LOG.isEnabledFor(logging.INFO):
+        LOG.info('Inside convert_dict(): obj type is: "%s", obj="%s"',
+            type(obj).__name__, unicode_me(obj))
     output = []
     addline = output.append
     
     item_name = item_func(parent)
     
     for key, val in obj.items():
-        LOG.info('Looping inside convert_dict(): key="%s", val="%s", type(val)="%s"' % (
-            unicode_me(key), unicode_me(val), type(val).__name__)
-        )
+        if LOG.isEnabledFor(logging.INFO):
+            LOG.info('Looping inside convert_dict(): key="%s", val="%s", type(val)="%s"',
+                unicode_me(key), unicode_me(val), type(val).__name__)
 
         attr = {} if not ids else {'id': '%s' % (get_unique_id(parent)) }
 
@@ -222,7 +255,7 @@ def convert_dict(obj, ids, parent, attr_type, item_func, cdata):
         elif type(val) == bool:
             addline(convert_bool(key, val, attr_type, attr, cdata))
 
-        elif isinstance(val, dict):
+        elif isinstance(val, Mapping):
             if attr_type:
                 attr['type'] = get_xml_type(val)
             addline('<%s%s>%s</%s>' % (
@@ -232,7 +265,7 @@ def convert_dict(obj, ids, parent, attr_type, item_func, cdata):
                 )
             )
 
-        elif isinstance(val, collections.Iterable):
+        elif isinstance(val, Iterable):
             if attr_type:
                 attr['type'] = get_xml_type(val)
             addline('<%s%s>%s</%s>' % (
@@ -256,7 +289,8 @@ def convert_dict(obj, ids, parent, attr_type, item_func, cdata):
 
 def convert_list(items, ids, parent, attr_type, item_func, cdata):
     """Converts a list into an XML string."""
-    LOG.info('Inside convert_list()')
+    if LOG.isEnabledFor(logging.INFO):
+        LOG.info('Inside convert_list()')
     output = []
     addline = output.append
 
@@ -266,9 +300,9 @@ def convert_list(items, ids, parent, attr_type, item_func, cdata):
         this_id = get_unique_id(parent)
 
     for i, item in enumerate(items):
-        LOG.info('Looping inside convert_list(): item="%s", item_name="%s", type="%s"' % (
-            unicode_me(item), item_name, type(item).__name__)
-        )
+        if LOG.isEnabledFor(logging.INFO):
+            LOG.info('Looping inside convert_list(): item="%s", item_name="%s", type="%s"',
+                unicode_me(item), item_name, type(item).__name__)
         attr = {} if not ids else { 'id': '%s_%s' % (this_id, i+1) }
         if isinstance(item, numbers.Number) or type(item) in (str, unicode):
             addline(convert_kv(item_name, item, attr_type, attr, cdata))
@@ -279,7 +313,7 @@ def convert_list(items, ids, parent, attr_type, item_func, cdata):
         elif type(item) == bool:
             addline(convert_bool(item_name, item, attr_type, attr, cdata))
             
-        elif isinstance(item, dict):
+        elif isinstance(item, Mapping):
             if not attr_type:
                 addline('<%s>%s</%s>' % (
                     item_name, 
@@ -295,7 +329,7 @@ def convert_list(items, ids, parent, attr_type, item_func, cdata):
                     )
                 )
 
-        elif isinstance(item, collections.Iterable):
+        elif isinstance(item, Iterable):
             if not attr_type:
                 addline('<%s %s>%s</%s>' % (
                     item_name, make_attrstring(attr), 
@@ -323,9 +357,9 @@ def convert_list(items, ids, parent, attr_type, item_func, cdata):
 
 def convert_kv(key, val, attr_type, attr={}, cdata=False):
     """Converts a number or string into an XML element"""
-    LOG.info('Inside convert_kv(): key="%s", val="%s", type(val) is: "%s"' % (
-        unicode_me(key), unicode_me(val), type(val).__name__)
-    )
+    if LOG.isEnabledFor(logging.INFO):
+        LOG.info('Inside convert_kv(): key="%s", val="%s", type(val) is: "%s"',
+            unicode_me(key), unicode_me(val), type(val).__name__)
 
     key, attr = make_valid_xml_name(key, attr)
 
@@ -341,9 +375,9 @@ def convert_kv(key, val, attr_type, attr={}, cdata=False):
 
 def convert_bool(key, val, attr_type, attr={}, cdata=False):
     """Converts a boolean into an XML element"""
-    LOG.info('Inside convert_bool(): key="%s", val="%s", type(val) is: "%s"' % (
-        unicode_me(key), unicode_me(val), type(val).__name__)
-    )
+    if LOG.isEnabledFor(logging.INFO):
+        LOG.info('Inside convert_bool(): key="%s", val="%s", type(val) is: "%s"',
+            unicode_me(key), unicode_me(val), type(val).__name__)
 
     key, attr = make_valid_xml_name(key, attr)
 
@@ -355,7 +389,8 @@ def convert_bool(key, val, attr_type, attr={}, cdata=False):
 
 def convert_none(key, val, attr_type, attr={}, cdata=False):
     """Converts a null value into an XML element"""
-    LOG.info('Inside convert_none(): key="%s"' % (unicode_me(key)))
+    if LOG.isEnabledFor(logging.INFO):
+        LOG.info('Inside convert_none(): key="%s"', unicode_me(key))
 
     key, attr = make_valid_xml_name(key, attr)
 
@@ -384,7 +419,8 @@ def dicttoxml(obj, root=True, custom_root='root', ids=False, attr_type=True,
     - cdata specifies whether string values should be wrapped in CDATA sections.
       Default is False
     """
-    LOG.info('Inside dicttoxml(): type(obj) is: "%s", obj="%s"' % (type(obj).__name__, unicode_me(obj)))
+    if LOG.isEnabledFor(logging.INFO):
+        LOG.info('Inside dicttoxml(): type(obj) is: "%s", obj="%s"', type(obj).__name__, unicode_me(obj))
     output = []
     addline = output.append
     if root == True:
@@ -399,16 +435,21 @@ def dicttoxml(obj, root=True, custom_root='root', ids=False, attr_type=True,
         addline(convert(obj, ids, attr_type, item_func, cdata, parent=''))
     return ''.join(output).encode('utf-8')
 
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" ?>'
+XSI_ROOT = '<%s  xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="declarationXMLtemplate_Schema _transport_merged.xsd">'
+
+
 def dict2xml(obj, root=True, custom_root='root', ids=False, attr_type=True,
     item_func=default_item_func, cdata=False):
     """
     """
-    LOG.info('Inside dict2xml(): type(obj) is: "%s", obj="%s"' % (type(obj).__name__, unicode_me(obj)))
+    if LOG.isEnabledFor(logging.INFO):
+        LOG.info('Inside dict2xml(): type(obj) is: "%s", obj="%s"', type(obj).__name__, unicode_me(obj))
     output = []
     addline = output.append
     if root == True:
-        addline('<?xml version="1.0" encoding="UTF-8" ?>')
-        addline('<%s  xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="declarationXMLtemplate_Schema _transport_merged.xsd">%s</%s>' % (
+        addline(XML_DECLARATION)
+        addline((XSI_ROOT + '%s</%s>') % (
         custom_root, 
         convert(obj, ids, attr_type, item_func, cdata, parent=custom_root), 
         custom_root,
@@ -417,3 +458,34 @@ def dict2xml(obj, root=True, custom_root='root', ids=False, attr_type=True,
     else:
         addline(convert(obj, ids, attr_type, item_func, cdata, parent=''))
     return ''.join(output).encode('utf-8')
+
+
+class StreamWriter(object):
+    """Writes a sequence of items as dict2xml(items, custom_root=...) does, 
+    but item by item to a binary file object, so the whole document is never
+    held in memory. Unique ids are not supported.
+    Usage:
+        writer = StreamWriter(fileobj, custom_root='persons')
+        for item in items:
+            writer.write(item)
+        writer.close()
+    """
+
+    def __init__(self, fileobj, custom_root='root', attr_type=True,
+        item_func=default_item_func, cdata=False):
+        self.fileobj = fileobj
+        self.custom_root = custom_root
+        self.attr_type = attr_type
+        self.item_func = item_func
+        self.cdata = cdata
+        self.fileobj.write((XML_DECLARATION + XSI_ROOT % (custom_root)).encode('utf-8'))
+
+    def write(self, item):
+        """Converts one item and writes it"""
+        self.fileobj.write(convert_list([item], False, self.custom_root, 
+            self.attr_type, self.item_func, self.cdata).encode('utf-8'))
+
+    def close(self):
+        """Writes the closing root tag and closes the file"""
+        self.fileobj.write(('</%s>' % (self.custom_root)).encode('utf-8'))
+        self.fileobj.close()
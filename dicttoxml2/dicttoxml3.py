@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Python 3 native version of dicttoxml2.dict2xml.
+
+Produces the same output as dicttoxml2 for the same arguments, but dispatches
+on the exact type of every value through a precomputed table, escapes with a
+single `str.translate` and appends all pieces of the document to one list
+instead of joining strings at every level of nesting.
+"""
+
+import numbers
+from collections.abc import Iterable, Mapping
+
+from . import dicttoxml2
+from .dicttoxml2 import (XML_DECLARATION, XSI_ROOT, default_item_func,
+    fix_xml_name, get_unique_id, get_xml_type)
+
+
+ESCAPE_TABLE = str.maketrans({
+    '&': '&amp;',
+    '"': '&quot;',
+    '\'': '&apos;',
+    '<': '&lt;',
+    '>': '&gt;',
+})
+
+NIL = ' xsi:nil="true"/>'
+
+# kinds of values, in the order dicttoxml2 checks them
+NUMBER, STRING, DATE, DICT, LIST, NONE = range(6)
+
+kinds = {
+    str: STRING,
+    int: NUMBER,
+    float: NUMBER,
+    bool: NUMBER, # a Number for dicttoxml2 as well, rendered as True/False
+    type(None): NONE,
+    dict: DICT,
+    list: LIST,
+    tuple: LIST,
+}
+
+names = {} # key -> (valid name, name attribute or None)
+
+
+def kind_of(val):
+    """Returns the kind of a value, caching it for its type"""
+    val_type = type(val)
+    try:
+        return kinds[val_type]
+    except KeyError:
+        pass
+    if isinstance(val, numbers.Number):
+        kind = NUMBER
+    elif hasattr(val, 'isoformat'):
+        kind = DATE
+    elif val is None:
+        kind = NONE
+    elif isinstance(val, Mapping):
+        kind = DICT
+    elif isinstance(val, Iterable):
+        kind = LIST
+    else:
+        raise TypeError('Unsupported data type: %s (%s)' % (val, val_type.__name__))
+    kinds[val_type] = kind
+    return kind
+
+
+def escape_xml(s):
+    """Escapes a string for use in text and attributes"""
+    return s.translate(ESCAPE_TABLE)
+
+
+def xml_name(key, attr):
+    """Valid element name for a key, see dicttoxml2.make_valid_xml_name"""
+    if not dicttoxml2.validate_names:
+        return key
+    try:
+        name, name_attr = names[key]
+    except KeyError:
+        escaped = escape_xml(key) if type(key) is str else key
+        name, to_attr = fix_xml_name(escaped)
+        name_attr = escaped if to_attr else None
+        names[key] = name, name_attr
+    if name_attr is not None:
+        attr['name'] = name_attr
+    return name
+
+
+def attrstring(attr):
+    """Returns an attribute string in the form ` key="val"` """
+    if not attr:
+        return ''
+    return ' ' + ' '.join(['%s="%s"' % (k, v) for k, v in attr.items()])
+
+
+def text(val, kind, cdata):
+    """Text of a number, string or date value"""
+    if kind == DATE:
+        val = val.isoformat()
+    elif kind == NUMBER:
+        val = '%s' % (val)
+        if not cdata:
+            return val
+    if cdata:
+        return '<![CDATA[' + val.replace(']]>', ']]]]><![CDATA[>') + ']]>'
+    return val.translate(ESCAPE_TABLE)
+
+
+def add_kv(out, key, val, kind, attr_type, attr, cdata):
+    """Appends a number, string or date element"""
+    key = xml_name(key, attr)
+    if attr_type:
+        attr['type'] = get_xml_type(val.isoformat() if kind == DATE else val)
+    out.append('<%s%s>%s</%s>' % (key, attrstring(attr), text(val, kind, cdata), key))
+
+
+def add_dict(out, obj, ids, parent, attr_type, item_func, cdata):
+    """Appends the elements of a dict"""
+    append = out.append
+    for key, val in obj.items():
+        attr = {} if not ids else {'id': '%s' % (get_unique_id(parent))}
+        key = xml_name(key, attr)
+        kind = kind_of(val)
+
+        if kind <= DATE:
+            add_kv(out, key, val, kind, attr_type, attr, cdata)
+
+        elif kind == DICT:
+            if attr_type:
+                attr['type'] = 'dict'
+            append('<%s%s>' % (key, attrstring(attr)))
+            add_dict(out, val, ids, key, attr_type, item_func, cdata)
+            append('</%s>' % (key))
+
+        elif kind == LIST:
+            if attr_type:
+                attr['type'] = 'list'
+            append('<%s%s>' % (key, attrstring(attr)))
+            add_list(out, val, ids, key, attr_type, item_func, cdata)
+            append('</%s>' % (key))
+
+        else:
+            append('<' + xml_name(key, attr) + NIL)
+
+
+def add_list(out, items, ids, parent, attr_type, item_func, cdata):
+    """Appends the elements of a list"""
+    append = out.append
+    item_name = item_func(parent)
+
+    if ids:
+        this_id = get_unique_id(parent)
+
+    for i, item in enumerate(items):
+        attr = {} if not ids else {'id': '%s_%s' % (this_id, i+1)}
+        kind = kind_of(item)
+
+        if kind <= DATE:
+            add_kv(out, item_name, item, kind, attr_type, attr, cdata)
+
+        elif kind == DICT:
+            append('<%s>' % (item_name) if not attr_type else '<%s type="dict">' % (item_name))
+            add_dict(out, item, ids, parent, attr_type, item_func, cdata)
+            append('</%s>' % (item_name))
+
+        elif kind == LIST:
+            if not attr_type:
+                append('<%s %s>' % (item_name, attrstring(attr)))
+            else:
+                append('<%s type="list"%s>' % (item_name, attrstring(attr)))
+            add_list(out, item, ids, item_name, attr_type, item_func, cdata)
+            append('</%s>' % (item_name))
+
+        else:
+            append('<' + xml_name(item_name, attr) + NIL)
+
+
+def add(out, obj, ids, attr_type, item_func, cdata, parent='root'):
+    """Appends any object"""
+    kind = kind_of(obj)
+    if kind <= DATE:
+        add_kv(out, item_func(parent), obj, kind, attr_type, {}, cdata)
+    elif kind == DICT:
+        add_dict(out, obj, ids, parent, attr_type, item_func, cdata)
+    elif kind == LIST:
+        add_list(out, obj, ids, parent, attr_type, item_func, cdata)
+    else:
+        out.append('<' + xml_name(item_func(parent), {}) + NIL)
+
+
+def dict2xml(obj, root=True, custom_root='root', ids=False, attr_type=True,
+    item_func=default_item_func, cdata=False):
+    """Converts a python object into XML, see dicttoxml2.dict2xml"""
+    out = []
+    if root == True:
+        out.append(XML_DECLARATION)
+        out.append(XSI_ROOT % (custom_root))
+        add(out, obj, ids, attr_type, item_func, cdata, parent=custom_root)
+        out.append('</%s>' % (custom_root))
+    else:
+        add(out, obj, ids, attr_type, item_func, cdata, parent='')
+    return ''.join(out).encode('utf-8')
+
+
+class StreamWriter(dicttoxml2.StreamWriter):
+    """dicttoxml2.StreamWriter using this module's converter"""
+
+    def write(self, item):
+        """Converts one item and writes it"""
+        out = []
+        add_list(out, [item], False, self.custom_root, self.attr_type,
+            self.item_func, self.cdata)
+        self.fileobj.write(''.join(out).encode('utf-8'))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; version 3 only.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Records are the compact, slotted types of parsed and mapped persons.
+
+A record behaves as a mutable mapping of its slots, in slot order, so code
+written for the dicts parse_person and map_data used to return keeps
+working, and a record equals a dict of the same items. A slot that was
+never set is not a key: parsed persons get `relativeOf` and `relationType`
+from iter_related, realties in use have no ownership keys."""
+
+from collections.abc import Mapping, MutableMapping
+
+
+MISSING = object() # default of the fields that are not set
+
+
+def make_init(fields):
+    """Keyword-only __init__ setting the given `fields`, as dataclasses do"""
+    source = 'def __init__(self, *, %s):\n' % (
+        ', '.join('%s=MISSING' % field for field in fields) or '_=MISSING')
+    for field in fields:
+        source += '    if %s is not MISSING:\n        self.%s = %s\n' % (field, field, field)
+    namespace = {'MISSING': MISSING}
+    exec(source, namespace) #pylint: disable=exec-used
+    return namespace['__init__']
+
+
+class Record(MutableMapping):
+    """Base of slotted records with a dict-like interface. Subclasses list
+    their keys in __slots__ and are made with keyword arguments"""
+
+    __slots__ = ()
+    fields = ()
+    keyset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = []
+        for klass in reversed(cls.__mro__):
+            fields.extend(klass.__dict__.get('__slots__', ()))
+        cls.fields = tuple(fields)
+        cls.keyset = frozenset(fields)
+        cls.__init__ = make_init(cls.fields)
+
+    def __getitem__(self, key):
+        if key in self.keyset:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value) # only fields can be set
+        except AttributeError:
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        if key not in self.keyset:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.fields:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def items(self):
+        """(key, value) pairs in field order"""
+        items = []
+        for key in self.fields:
+            value = getattr(self, key, MISSING)
+            if value is not MISSING:
+                items.append((key, value))
+        return items
+
+    def copy(self):
+        """Shallow copy"""
+        return type(self)(**dict(self.items()))
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, dict(self.items()))
+
+
+class Person(Record):
+    """Parsed person, see parse_block and iter_related"""
+    __slots__ = ('p_raw', 'p', 'person_id', 'person_num', 'start', 'end', 'name',
+                 'position', 'income', 'ownership', 'usage', 'vehicle',
+                 'relativeOf', 'relationType')
+
+
+class Ownership(Record):
+    """Parsed realty in ownership"""
+    __slots__ = ('own_obj', 'own_type', 'own_sq', 'own_location')
+
+
+class Usage(Record):
+    """Parsed realty in use"""
+    __slots__ = ('use_obj', 'use_sq', 'use_loc')
+
+
+class Vehicle(Record):
+    """Parsed vehicle"""
+    __slots__ = ('vehicle_item', 'vehicle_pay')
+
+
+class MappedPerson(Record):
+    """Person as saved to xml, see map_data"""
+    __slots__ = ('id', 'name', 'relativeOf', 'relationType', 'position',
+                 'realties', 'transports', 'income', 'incomeComment', 'incomeSource')
+
+
+class Realty(Record):
+    """Realty as saved to xml, realties in use have no ownership keys"""
+    __slots__ = ('realtyType', 'objectType', 'ownershipType', 'ownershipPart',
+                 'square', 'country')
+
+
+class Transport(Record):
+    """Transport as saved to xml"""
+    __slots__ = ('transportName',)
+
+
+def as_dict(obj):
+    """Plain dicts and lists in place of the records in `obj`"""
+    if isinstance(obj, Mapping):
+        return {key: as_dict(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [as_dict(item) for item in obj]
+    return obj
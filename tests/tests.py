@@ -3,8 +3,28 @@
 
 import unittest
 import xparse
+import xbatch
 import openpyxl
 import pickle
+import tempfile
+import xcache
+import utils
+import io
+import importlib.util
+import csv
+import os
+import json
+import shutil
+import subprocess
+import sys
+import xschema
+import records
+import xlog
+import xlayout
+import xcolumns
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dicttoxml2 import dicttoxml2, dicttoxml3
 
 class TestHell(unittest.TestCase):
 
@@ -69,6 +89,163 @@ class TestHell(unittest.TestCase):
         self.assertListEqual(self.data_all, xparse.parse_person('A2:A787'))
 
 
+    def test_iter_parse(self):
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+
+        persons = xparse.iter_parse('tests/test_data/test_book.xlsx')
+        self.assertEqual(next(persons), self.data_all[0])
+        self.assertListEqual(self.data_all[1:], list(persons))
+
+        blocks = list(xparse.iter_row_blocks([(None, 'header'), (1, 'a'), (None, 'b'), (2, 'c')]))
+        self.assertEqual(blocks, [(1, [(1, 'a'), (None, 'b')]), (3, [(2, 'c')])])
+
+
+    def test_parse_person_workers(self):
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+
+        self.assertListEqual(self.data_all, xparse.parse_person('A2:A787', workers=2))
+
+
+    def test_parse_person_read_only(self):
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+
+        xparse.ws = xparse.load_file('tests/test_data/test_book.xlsx', read_only=True,
+                                     max_col=xparse.layout_max_col('A2:A787'))
+        try:
+            self.assertIsInstance(xparse.ws, xparse.ValueSheet)
+            self.assertListEqual(self.data_all, xparse.parse_person('A2:A787'))
+        finally:
+            xparse.ws = self.ws
+
+
+    def test_parser(self):
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dictionaries.json')
+            with open(path, 'w') as fout:
+                json.dump({'objectType': {'квартира': 100}}, fout)
+            parsers = [xparse.Parser(self.ws), xparse.Parser(self.ws, xparse.Context(path))]
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                parsed = list(executor.map(lambda parser: parser.parse_person(), parsers))
+            for persons in parsed:
+                self.assertListEqual(self.data_all, persons)
+            self.assertIs(parsers[0].context, xparse.context)
+            xparse.set_relations(xparse.iter_blocks(parsed[1]))
+            person = next(person for person in parsed[1]
+                          if person['ownership'] and person['ownership'][0]['own_obj'] == 'квартира')
+            self.assertEqual(parsers[0].map_data(person)['realties'][0]['objectType'], 7)
+            self.assertEqual(parsers[1].map_data(person)['realties'][0]['objectType'], 100)
+
+            # files are mapped with the dictionaries of the parser as well
+            blocks = list(xparse.iter_blocks(parsed[1]))
+            expected = dicttoxml2.dict2xml([parsers[1].map_data(person) for person in parsed[1]],
+                                           attr_type=False, item_func=xparse.parent_to_child,
+                                           custom_root='persons')
+            cache = xcache.BlockCache(os.path.join(tmp, 'cache'))
+            for run, kwargs in enumerate([{}, {'cache': cache}, {'cache': cache},
+                                          {'split_at': 200, 'workers': 2}]):
+                save_dir = os.path.join(tmp, 'out%s' % run)
+                parsers[1].save_to_file(blocks, save_dir=save_dir, **kwargs)
+                file_name, = os.listdir(save_dir)
+                with open(os.path.join(save_dir, file_name), 'rb') as fin:
+                    self.assertEqual(fin.read(), expected)
+            self.assertEqual(cache.hits, len(blocks))
+
+        slot = {'start': 'B2', 'end': 'B4'}
+        self.assertListEqual(parsers[0].parse_ownership(slot), xparse.parse_ownership(slot))
+        self.assertListEqual(parsers[0].parse_vehicle(slot), xparse.parse_vehicle(slot))
+        self.assertEqual(parsers[0].detect_column_range(), 'A2:A787')
+        empty = xparse.Parser(xparse.ValueSheet([('pp', 'name'), (None, 'Бах')]))
+        self.assertListEqual(empty.parse_person(), [])
+        with self.assertRaises(ValueError):
+            parsers[0].parse_person('A2-A787')
+
+
+    def test_layout(self):
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+
+        profile = {
+            'columns': {'number': 0, 'position': 1, 'name': 2, 'income': 3, 'vehicle_item': 4,
+                        'own_obj': 5, 'own_type': 6, 'own_sq': 7, 'own_location': 8,
+                        'use_obj': 9, 'use_sq': 10, 'use_loc': 11},
+            'header': {'number': '№', 'position': 'Должность', 'name': ['фамилия', 'ФИО'],
+                       'vehicle_item': 'Транспорт'}}
+        layout = xlayout.compile_layout('other', profile)
+        self.assertEqual(layout.width, 12)
+        self.assertFalse(layout.canonical)
+        self.assertEqual(layout.column(xparse.NAME), 2)
+        self.assertEqual(list(layout.remap([tuple(range(12))])),
+                         [(0, 2, 1, 3, 5, 6, 7, 8, 9, 10, 11, 4, None)])
+        for broken in ({'columns': {'number': 0}},
+                       {'columns': {'number': 1, 'name': 0}},
+                       {'columns': {'number': 0, 'name': 0}},
+                       {'columns': {'number': 0, 'name': 1, 'surname': 2}},
+                       {'columns': {'number': 0, 'name': 1}, 'header': {'income': 'Доход'}}):
+            self.assertRaises(ValueError, xlayout.compile_layout, 'broken', broken)
+
+        # the test book rows in the columns of the profile
+        sheet = openpyxl.Workbook().active
+        sheet.append(['№ п/п', 'Должность', 'Фамилия, инициалы', 'Доход', 'Транспорт'])
+        for row in xparse.Parser(self.ws).read_rows(xparse.Coord(2, 1), xparse.Coord(787, 1)):
+            sheet.append([row[col] for col in (0, 2, 1, 3, 11, 4, 5, 6, 7, 8, 9, 10)])
+
+        expected = [person.copy() for person in self.data_all]
+        for person in expected:
+            person['start'] = 'C' + person['start'][1:]
+            person['end'] = 'C' + person['end'][1:]
+            person['vehicle'] = [records.Vehicle(vehicle_item=vehicle['vehicle_item'],
+                                                 vehicle_pay=None)
+                                 for vehicle in person['vehicle']]
+        with tempfile.TemporaryDirectory() as tmp:
+            shutil.copy(os.path.join(xlayout.LAYOUTS_DIR, 'mvd.json'), tmp)
+            with open(os.path.join(tmp, 'other.json'), 'w') as fout:
+                json.dump(profile, fout)
+            context = xparse.Context(layouts_dir=tmp)
+            parser = xparse.Parser(sheet, context)
+            self.assertEqual(parser.detect_column_range(), 'A2:A787')
+            self.assertListEqual(expected, parser.parse_person())
+            self.assertEqual(parser.layout.name, 'other')
+            self.assertEqual(xparse.Parser(self.ws, context).select_layout().name, 'mvd')
+            self.assertEqual(xparse.Parser(sheet, context, 'mvd').layout.name, 'mvd')
+            self.assertRaises(ValueError, xparse.Parser, sheet, context, 'fns')
+            self.assertListEqual(parser.parse_ownership(expected[3]), expected[3]['ownership'])
+            self.assertListEqual(parser.parse_vehicle(expected[3]), expected[3]['vehicle'])
+
+            # numbering in column C, the slot name column in E
+            shifted = openpyxl.Workbook().active
+            for row in sheet.iter_rows(values_only=True):
+                shifted.append((None, None) + row)
+            slot = dict(expected[3], start='E' + expected[3]['start'][1:],
+                        end='E' + expected[3]['end'][1:])
+            parser = xparse.Parser(shifted, context)
+            self.assertListEqual(parser.parse_ownership(slot), expected[3]['ownership'])
+            self.assertEqual(parser.layout.name, 'other')
+
+            self.assertEqual(xparse.layout_max_col('A2:A787'), xparse.LAYOUT_WIDTH)
+            self.assertEqual(xparse.layout_max_col('C2', 'other', context), 14)
+            profile['columns']['use_loc'] = 15
+            with open(os.path.join(tmp, 'wide.json'), 'w') as fout:
+                json.dump(profile, fout)
+            wide = xparse.Context(layouts_dir=tmp)
+            self.assertEqual(xparse.layout_max_col('B2', context=wide), 17)
+            self.assertEqual(xparse.layout_max_col('B2', 'mvd', wide), 14)
+
+
+    def test_detect_column_range(self):
+        self.assertEqual(xparse.detect_column_range(), 'A2:A787')
+        self.assertIsNone(xparse.detect_column_range('N'))
+        self.assertTrue(xparse.is_numbering(' 12. '))
+        self.assertTrue(xparse.is_numbering(3.0))
+        self.assertFalse(xparse.is_numbering('pp'))
+        self.assertFalse(xparse.is_numbering(None))
+
+
     def test_check_lists_mismatch(self):
         list_a = [1,2,3,4,5,6,7,8,9,10]
         list_b = [1,2,3,4,5,6,8,9,10]
@@ -88,13 +265,44 @@ class TestHell(unittest.TestCase):
 
         self.assertListEqual(self.slots_data, xparse.get_slot('A2', 'A787'))
 
+
+    def test_get_row_slots(self):
+        rows = [(None,), (1,), (' ',), (None,), (' - ',), (2,), ('3',)]
+        self.assertListEqual(xparse.get_row_slots(rows, 0),
+                             [(1, 4, 1), (5, 5, 2), (6, 6, '3')])
+        self.assertListEqual(xparse.get_row_slots([], 0), [])
+
+
+    def test_find_slots(self):
+        numbers = [None, 1, None, None, 2, ' ', None]
+        names = ['x', 'Бах', 'супруга', None, 'Гендель', None, 'сын']
+        self.assertListEqual(xparse.find_slots(numbers), [(1, 3, 1), (4, 6, 2)])
+        self.assertListEqual(xparse.find_slots(names), [(0, 0, 'x'), (1, 1, 'Бах'),
+                                                        (2, 3, 'супруга'), (4, 5, 'Гендель'),
+                                                        (6, 6, 'сын')])
+        self.assertEqual(xparse.find_slots([None, '-']), [])
+
     
     def test_shift_col(self):
         self.assertEqual(xparse.shift_col('A1'), 'B1')
         self.assertEqual(xparse.shift_col('M99'), 'N99')
         self.assertEqual(xparse.shift_col('D11', 3), 'G11')
-        self.assertIsNone(xparse.shift_col('Z4', 2))
+        self.assertEqual(xparse.shift_col('Z4', 2), 'AB4')
+        self.assertEqual(xparse.shift_col('AZ4'), 'BA4')
         self.assertEqual(xparse.shift_col('D9', 10), 'N9')
+        self.assertEqual(xparse.shift_col('B9', -1), 'A9')
+        self.assertIsNone(xparse.shift_col('A9', -1))
+
+
+    def test_coord(self):
+        self.assertEqual(xparse.Coord.parse('B12'), (12, 2))
+        self.assertEqual(xparse.Coord.parse('gb7'), (7, 184))
+        self.assertEqual(str(xparse.Coord(7, 184)), 'GB7')
+        self.assertEqual(str(xparse.Coord.parse('Z3').shift(1, 2)), 'AA5')
+        self.assertLess(xparse.Coord.parse('Z3'), xparse.Coord.parse('A4'))
+        self.assertRaises(ValueError, xparse.Coord.parse, '12')
+        self.assertListEqual(xparse.get_sorted_coord(['B10', 'AA2', 'A9']),
+                             ['AA2', 'A9', 'B10'])
     
 
     def test_parse_ownership(self):
@@ -173,6 +381,75 @@ class TestHell(unittest.TestCase):
         self.assertEqual(xparse.value_from_dict('  - ', 'none_values'), None)
         self.assertEqual(xparse.value_from_dict('  -', 'none_values'), None)
 
+
+    def test_lookup(self):
+        lookup = xparse.Lookup({'objectType': {'квартира': 7, 'нежилое помещение ': 2}})
+        self.assertEqual(lookup.code(' Квартира '), ' Квартира ')
+        self.assertEqual(lookup.code(' Квартира ', 'objectType'), 7)
+        self.assertEqual(lookup.code('Квартира', 'objectType'), 7)
+        self.assertEqual(lookup.code('нежилое помещение ', 'objectType'), 'нежилое помещение ')
+        self.assertEqual(lookup.code(12.5, 'objectType'), 12.5)
+        self.assertIsNone(lookup.code(None, 'objectType'))
+        self.assertEqual(lookup.code('нежилое помещение ', 'objectType'), 'нежилое помещение ')
+        self.assertEqual(lookup.misses['objectType']['нежилое помещение '], 2)
+        self.assertEqual(sum(lookup.misses['objectType'].values()), 3)
+        self.assertEqual(sum(lookup.misses['none_values'].values()), 1)
+        lookup.log_misses()
+        self.assertEqual(lookup.misses, {})
+
+
+    def test_lookup_fuzzy(self):
+        lookup = xparse.Lookup(xparse.dictionaries)
+        self.assertEqual(lookup.code('Замельный участок', 'objectType'), 'Замельный участок')
+        lookup.set_fuzzy(2)
+        self.assertEqual(lookup.code('Замельный участок', 'objectType'), 1)
+        self.assertEqual(lookup.code('квартра', 'objectType'), 7)
+        self.assertEqual(lookup.code('кваритра', 'objectType'), 'кваритра')
+        self.assertEqual(lookup.code('Кафиристан', 'country'), 'Кафиристан')
+        self.assertEqual(lookup.code('Росия', 'country'), 6)
+        self.assertEqual(lookup.code('сшв', 'country'), 'сшв')
+        self.assertEqual(lookup.code(' -- ', 'none_values'), ' -- ')
+        self.assertEqual(sum(lookup.fuzzy_matches['objectType'].values()), 2)
+
+
+    def test_context(self):
+        context = xparse.Context(xparse.DICTIONARIES_FILE)
+        self.assertIsNone(context._dictionaries)
+        self.assertIs(context.lookup, context.lookup)
+        self.assertIsNotNone(context._dictionaries)
+        self.assertEqual(context.lookup.code('квартира', 'objectType'), 7)
+        self.assertEqual(context.digest(), xparse.dictionaries_digest())
+        self.assertIs(xparse.lookup, xparse.context.lookup)
+        with self.assertRaises(AttributeError):
+            xparse.no_such_name
+        # importing neither reads dictionaries.json nor imports openpyxl, from any cwd
+        code = ('import sys, xparse; '
+                'print(xparse.context._dictionaries, "openpyxl" in sys.modules)')
+        with tempfile.TemporaryDirectory() as cwd:
+            env = dict(os.environ, PYTHONPATH=os.path.abspath('.'))
+            out = subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env,
+                                 capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.split(), ['None', 'False'])
+
+
+    def test_bk_tree(self):
+        words = ['квартира', 'гараж', 'дача', 'дом', 'жилой дом']
+        tree = utils.BKTree(words)
+        self.assertListEqual(tree.search('гаращ', 1), [(1, 'гараж')])
+        self.assertListEqual(tree.search('дома', 2), [(1, 'дом'), (2, 'дача')])
+        self.assertListEqual(tree.search('вилла', 2), [])
+        self.assertEqual(utils.bounded_distance('kitten', 'sitting', 5), 3)
+        self.assertEqual(utils.bounded_distance('kitten', 'sitting', 1), 2)
+        words = sorted(set(xparse.context.dictionaries['objectType']))
+        tree = utils.BKTree(words)
+        for query in ('квартра', 'жилой дон', 'гаражный бокс', 'зем. участок', 'x'):
+            for max_dist in (1, 2, 3):
+                distances = [(utils.bounded_distance(query, word, len(query) + len(word)), word)
+                             for word in words]
+                self.assertListEqual(tree.search(query, max_dist),
+                                     sorted(item for item in distances if item[0] <= max_dist))
+        self.assertEqual(utils.best_match('кваритра', {w: 0 for w in words}), 'квартира')
+
     
     def test_set_name(self):
         self.pd = {'name':'Иоганн Бах','relativeOf':'Амброзий Бах'}
@@ -297,6 +574,28 @@ class TestHell(unittest.TestCase):
         self.assertEqual(self.blocks_by_p, xparse.make_blocks(self.data_all))
 
 
+    def test_iter_blocks(self):
+        with open('tests/test_data/blocks_by_p.pkl', 'rb') as pkl:
+            self.blocks_by_p = pickle.load(pkl)
+
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+
+        blocks = xparse.iter_blocks(self.data_all)
+        self.assertNotIsInstance(blocks, list)
+        self.assertEqual(self.blocks_by_p, list(blocks))
+
+
+    def test_iter_related(self):
+        with open('tests/test_data/blocks_by_p_unrelated.pkl', 'rb') as pkl:
+            self.unrelated = pickle.load(pkl)
+
+        with open('tests/test_data/blocks_by_p_related.pkl', 'rb') as pkl:
+            self.related = pickle.load(pkl)
+
+        self.assertEqual(self.related, list(xparse.iter_related(iter(self.unrelated))))
+
+
     def test_get_p(self):
         with open('tests/test_data/blocks.pkl', 'rb') as pkl:
             self.blocks = pickle.load(pkl)
@@ -326,6 +625,373 @@ class TestHell(unittest.TestCase):
         self.assertEqual(xparse.parent_to_child('persons'), 'person')
 
     
+    # Cache
+
+    def test_block_cache(self):
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = xcache.BlockCache(cache_dir)
+            with self.assertLogs(xparse.logger, 'INFO') as parsed:
+                self.assertListEqual(self.data_all, xparse.parse_person('A2:A787', cache=cache))
+            self.assertEqual(cache.hits, 0)
+            with self.assertLogs(xparse.logger, 'INFO') as cached:
+                self.assertListEqual(self.data_all, xparse.parse_person('A2:A787', cache=cache))
+            self.assertEqual(cache.hits, 99)
+            # warnings of the parsed blocks are logged again when they are cached
+            self.assertIn('WARNING:xparse:Value missing at L21?', parsed.output)
+            self.assertListEqual(parsed.output[:-1], cached.output[:-1])
+
+            # same blocks one row lower are rebased
+            rows = [(None,) * xparse.LAYOUT_WIDTH] + list(xparse.read_rows(
+                xparse.Coord(1, 1), xparse.Coord(787, 1)))
+            moved = xparse.parse_rows(rows[2:], xparse.Coord(3, 1), cache=cache)
+            self.assertEqual(cache.hits, 198)
+            self.assertListEqual([p['end'] for p in moved],
+                                 [str(xparse.Coord.parse(p['end']).shift(0, 1))
+                                  for p in self.data_all])
+
+            blocks = xparse.make_blocks(self.data_all)
+            xparse.set_relations(blocks)
+            blocks[0][0]['ownership'][0]['own_obj'] = 'замок'
+            blocks[0][0]['ownership'][0]['own_type'] = 'странная'
+            blocks[1][0]['name'] = 'супруга'
+            lookup = xparse.context.lookup
+            lookup.take_misses()
+            with self.assertLogs(xparse.logger, 'INFO') as logged:
+                mapped = [xparse.map_block(block) for block in blocks]
+            misses = lookup.take_misses()
+            self.assertEqual(misses[0], {'objectType': {'замок': 1},
+                                         'ownershipType': {'странная': 1}})
+            self.assertListEqual(logged.output, [
+                'INFO:xparse:Ownership unknown: странная',
+                'WARNING:xparse:Missing person: P=2 at %s' % blocks[1][0]['start']])
+            for _ in range(2): # mapped, then taken from the cache
+                with self.assertLogs(xparse.logger, 'INFO') as cached:
+                    self.assertListEqual(mapped,
+                                         [xparse.map_block(block, cache) for block in blocks])
+                self.assertEqual(lookup.take_misses(), misses)
+                self.assertListEqual(cached.output, logged.output)
+            self.assertEqual(cache.hits, 198 + 99)
+            # a moved block is logged with its place now
+            moved = [dict(person.items()) for person in blocks[1]]
+            for person in moved:
+                person['p'], person['start'] = 5, 'B500'
+            with self.assertLogs(xparse.logger, 'INFO') as cached:
+                xparse.map_block(moved, cache)
+            self.assertListEqual(cached.output, ['WARNING:xparse:Missing person: P=5 at B500'])
+            self.assertEqual(cache.hits, 198 + 99 + 1)
+
+            self.assertEqual(xcache.BlockCache(cache_dir, max_size=0).evict(), 2 * 99)
+            self.assertListEqual(cache.entries(), [])
+
+
+    # Batch
+
+    def test_find_files(self):
+        self.assertListEqual(xbatch.find_files(['tests/test_data']),
+                             ['tests/test_data/test_book.xlsx'])
+        self.assertEqual(xbatch.output_dir('data/book_1.xlsx', 'out'), 'out/book_1')
+        self.assertListEqual(
+            xbatch.output_dirs(['r1/book.xlsx', 'r2/book.xlsx', 'r2/other.xlsx',
+                                'r1_book.xlsx'], 'out'),
+            [os.path.join('out', name) for name in ('r1_book', 'r2_book', 'other', 'r1_book-2')])
+        book = 'tests/test_data/test_book.xlsx'
+        self.assertListEqual(xbatch.unique_jobs([(book, None), ('./' + book, 'A2:A787'),
+                                                 ('tests/test_data/other.xlsx', None)]),
+                             [(book, None), ('tests/test_data/other.xlsx', None)])
+
+    
+    def test_parse_batch(self):
+        book = 'tests/test_data/test_book.xlsx'
+        with tempfile.TemporaryDirectory() as tmp:
+            for folder in ('r1', 'r2'):
+                os.mkdir(os.path.join(tmp, folder))
+                shutil.copy(book, os.path.join(tmp, folder, 'book.xlsx'))
+            jobs = [(os.path.join(tmp, 'r1', 'book.xlsx'), None),
+                    (os.path.join(tmp, 'r2', 'book.xlsx'), None),
+                    (os.path.join(tmp, 'r2', '.', 'book.xlsx'), None)]
+            save_dir = os.path.join(tmp, 'out')
+            results = xbatch.parse_batch(jobs, save_dir, workers=2)
+            self.assertEqual([stats['error'] for stats in results], [None, None])
+            self.assertListEqual(sorted(os.listdir(save_dir)), ['r1_book', 'r2_book'])
+            for name in ('r1_book', 'r2_book'):
+                self.assertListEqual(os.listdir(os.path.join(save_dir, name)),
+                                     ['persons-99.xml'])
+
+    
+    def test_stream_writer(self):
+        persons = []
+        for name in ('mapped_person', 'mapped_person2', 'mapped_person3'):
+            with open('tests/test_data/%s.pkl' % name, 'rb') as pkl:
+                persons.append(pickle.load(pkl))
+        persons[0]['name'] = '<Бах & "сыновья">'
+
+        fileobj = io.BytesIO()
+        fileobj.close = lambda: None
+        writer = dicttoxml2.StreamWriter(fileobj, attr_type=False,
+                                         item_func=xparse.parent_to_child,
+                                         custom_root='persons')
+        for person in persons:
+            writer.write(person)
+        writer.close()
+        self.assertEqual(fileobj.getvalue(),
+                         dicttoxml2.dict2xml(persons, attr_type=False,
+                                             item_func=xparse.parent_to_child,
+                                             custom_root='persons'))
+
+    
+    def test_dicttoxml3(self):
+        persons = []
+        for name in ('mapped_person', 'mapped_person2', 'mapped_person3'):
+            with open('tests/test_data/%s.pkl' % name, 'rb') as pkl:
+                persons.append(pickle.load(pkl))
+        persons[0]['name'] = '<Бах & "сыновья"> ]]>'
+        persons[1]['1 extra'] = [None, True, 2.5, ('a b', {'a<b': 'c'})]
+        for attr_type in (False, True):
+            for cdata in (False, True):
+                self.assertEqual(
+                    dicttoxml3.dict2xml(persons, attr_type=attr_type, cdata=cdata,
+                                        custom_root='persons'),
+                    dicttoxml2.dict2xml(persons, attr_type=attr_type, cdata=cdata,
+                                        custom_root='persons'))
+        self.assertEqual(dicttoxml3.dict2xml({'a': 1}, root=False), b'<a type="int">1</a>')
+
+        fileobj = io.BytesIO()
+        fileobj.close = lambda: None
+        writer = dicttoxml3.StreamWriter(fileobj, attr_type=False,
+                                         item_func=xparse.parent_to_child,
+                                         custom_root='persons')
+        for person in persons[2:]:
+            writer.write(person)
+        writer.close()
+        self.assertEqual(fileobj.getvalue(),
+                         dicttoxml2.dict2xml(persons[2:], attr_type=False,
+                                             item_func=xparse.parent_to_child,
+                                             custom_root='persons'))
+
+    
+    def test_schema_writer(self):
+        persons = []
+        for name in ('mapped_person', 'mapped_person2', 'mapped_person3'):
+            with open('tests/test_data/%s.pkl' % name, 'rb') as pkl:
+                persons.append(pickle.load(pkl))
+        persons[0]['name'] = '<Бах & "сыновья">'
+        persons[1]['transports'] = [OrderedDict([('transportName', 'ВАЗ 2101')])]
+        persons[2]['income'] = True # not a plain value, written by dicttoxml3
+        expected = dicttoxml2.dict2xml(persons, attr_type=False,
+                                       item_func=xparse.parent_to_child,
+                                       custom_root='persons')
+        self.assertEqual(xschema.persons2xml(persons, 'persons', xparse.parent_to_child),
+                         expected)
+
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+        blocks = list(xparse.iter_related(xparse.iter_blocks(self.data_all)))
+        mapped = [xparse.map_data(person) for block in blocks for person in block]
+        expected = dicttoxml2.dict2xml(mapped, attr_type=False,
+                                       item_func=xparse.parent_to_child,
+                                       custom_root='persons')
+        with tempfile.TemporaryDirectory() as tmp:
+            for serializer in xparse.WRITERS:
+                save_dir = os.path.join(tmp, serializer)
+                self.assertEqual(xparse.save_to_file(blocks, 0, save_dir, serializer=serializer),
+                                 (len(blocks), len(mapped)))
+                with open(os.path.join(save_dir, 'persons-%s.xml' % len(blocks)), 'rb') as fin:
+                    self.assertEqual(fin.read(), expected)
+
+    
+    def test_save_to_file_workers(self):
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+        self.data_all[0]['ownership'][0]['own_obj'] = 'замок'
+        blocks = list(xparse.iter_related(xparse.iter_blocks(self.data_all)))
+        lookup = xparse.context.lookup
+        lookup.take_misses()
+        with tempfile.TemporaryDirectory() as tmp:
+            serial, parallel = os.path.join(tmp, 'serial'), os.path.join(tmp, 'parallel')
+            saved = xparse.save_to_file(blocks, 20, serial)
+            misses = lookup.take_misses()
+            self.assertEqual(misses[0], {'objectType': {'замок': 1}})
+            self.assertEqual(saved, xparse.save_to_file(blocks, 20, parallel, workers=2))
+            # misses of the workers are counted in this process
+            self.assertEqual(lookup.take_misses(), misses)
+            names = sorted(os.listdir(serial))
+            self.assertEqual(names, sorted(os.listdir(parallel)))
+            self.assertIn('persons-81-%s.xml' % len(blocks), names)
+            for name in names:
+                with open(os.path.join(serial, name), 'rb') as fin:
+                    expected = fin.read()
+                with open(os.path.join(parallel, name), 'rb') as fin:
+                    self.assertEqual(fin.read(), expected)
+
+            # spawned workers do not inherit the context, it is sent to them
+            self.data_all[1]['ownership'][0]['own_obj'] = 'квартра'
+            with open(os.path.join(tmp, 'blocks.pkl'), 'wb') as fout:
+                pickle.dump(list(xparse.iter_related(xparse.iter_blocks(self.data_all))), fout)
+            code = '\n'.join([
+                'import multiprocessing, os, pickle, sys, xparse',
+                'from concurrent.futures import ProcessPoolExecutor',
+                'blocks = pickle.load(open("blocks.pkl", "rb"))',
+                'xparse.context.lookup.set_fuzzy(2)',
+                'xparse.save_to_file(blocks, 20, "serial")',
+                'spawn = multiprocessing.get_context("spawn")',
+                'with ProcessPoolExecutor(2, mp_context=spawn) as executor:',
+                '    xparse.save_to_file(blocks, 20, "spawned", workers=2, executor=executor)',
+                'print(all(open(os.path.join("serial", name), "rb").read() ==',
+                '          open(os.path.join("spawned", name), "rb").read()',
+                '          for name in os.listdir("serial")), "квартра" in str(blocks))'])
+            env = dict(os.environ, PYTHONPATH=os.path.abspath('.'))
+            out = subprocess.run([sys.executable, '-c', code], cwd=tmp, env=env,
+                                 capture_output=True, text=True, check=True).stdout
+            self.assertEqual(out.split(), ['True', 'True'])
+
+    
+    def test_columns(self):
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+        declarations = xcolumns.Declarations.from_persons(self.data_all)
+        self.assertEqual(len(declarations), len(self.data_all))
+        self.assertEqual(len(declarations.ownership),
+                         sum(len(person['ownership']) for person in self.data_all))
+        self.assertFalse(declarations.related)
+        self.assertListEqual(self.data_all, list(declarations.iter_persons()))
+
+        blocks = list(xparse.iter_related(xparse.iter_blocks(self.data_all)))
+        persons = [person for block in blocks for person in block]
+        declarations.set_relations()
+        self.assertListEqual(persons, list(declarations.iter_persons()))
+        self.assertEqual([len(block) for block in blocks], declarations.block_sizes())
+        self.assertListEqual([xparse.map_data(person) for person in persons],
+                             declarations.map())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            expected, columns = os.path.join(tmp, 'expected'), os.path.join(tmp, 'columns')
+            self.assertEqual(xparse.save_to_file(blocks, 20, expected),
+                             declarations.save_to_file(20, columns))
+            names = sorted(os.listdir(expected))
+            self.assertEqual(names, sorted(os.listdir(columns)))
+            for name in names:
+                with open(os.path.join(expected, name), 'rb') as fin:
+                    content = fin.read()
+                with open(os.path.join(columns, name), 'rb') as fin:
+                    self.assertEqual(fin.read(), content)
+
+            declarations.write_csv(tmp)
+            with open(os.path.join(tmp, 'vehicle.csv'), newline='') as fin:
+                rows = list(csv.reader(fin))
+            self.assertEqual(rows[0], ['person_id', 'vehicle_item', 'vehicle_pay'])
+            self.assertEqual(len(rows), len(declarations.vehicle) + 1)
+
+        squares = [xcolumns.to_number(item['own_sq'])
+                   for person in self.data_all for item in person['ownership']]
+        self.assertAlmostEqual(declarations.total_area(),
+                               sum(square for square in squares if square is not None))
+        by_position = declarations.income_by_position()
+        self.assertEqual(sum(entry['persons'] for entry in by_position.values()),
+                         sum(1 for person in self.data_all if person['person_num'] == 1
+                             and xcolumns.to_number(person['income']) is not None))
+
+        self.assertEqual(xcolumns.to_number('1 234,5'), 1234.5)
+        self.assertEqual(xcolumns.to_number(12), 12.0)
+        self.assertIsNone(xcolumns.to_number('не имеет'))
+        self.assertIsNone(xcolumns.to_number(True))
+        self.assertEqual(xcolumns.column_dtype([1, 2]), 'i8')
+        self.assertEqual(xcolumns.column_dtype([1, None, 2.5]), 'f8')
+        self.assertEqual(xcolumns.column_dtype([1, 'a']), 'O')
+
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), 'NumPy is not installed')
+    def test_columns_numpy(self):
+        with open('tests/test_data/data_all.pkl', 'rb') as pkl:
+            self.data_all = pickle.load(pkl)
+        declarations = xcolumns.Declarations.from_persons(self.data_all)
+        array = declarations.ownership.to_numpy(numeric=('own_sq',))
+        self.assertEqual(len(array), len(declarations.ownership))
+        self.assertEqual(array.dtype['person_id'].kind, 'i')
+        self.assertEqual(array.dtype['own_sq'].kind, 'f')
+        squares = array['own_sq']
+        self.assertAlmostEqual(float(squares[squares == squares].sum()), # NaN != NaN
+                               declarations.total_area())
+
+    
+    def test_records(self):
+        with open('tests/test_data/person_data.pkl', 'rb') as pkl:
+            person_data = pickle.load(pkl)
+        with open('tests/test_data/mapped_person.pkl', 'rb') as pkl:
+            mapped_data = pickle.load(pkl)
+
+        person = records.Person(**person_data)
+        self.assertEqual(person, person_data)
+        mapped = xparse.map_data(person)
+        self.assertIsInstance(mapped, records.MappedPerson)
+        self.assertEqual(list(mapped.items()), list(mapped_data.items()))
+        self.assertEqual(pickle.loads(pickle.dumps(mapped)), mapped)
+        self.assertEqual(records.as_dict(mapped), mapped_data)
+
+        realty = records.Realty(realtyType='2', objectType=1, square=40, country=6)
+        self.assertEqual(list(realty), ['realtyType', 'objectType', 'square', 'country'])
+        self.assertNotIn('ownershipType', realty)
+        self.assertIsNone(realty.get('ownershipPart'))
+        realty['square'] = 41
+        self.assertEqual(realty.copy(), {'realtyType': '2', 'objectType': 1,
+                                         'square': 41, 'country': 6})
+        with self.assertRaises(KeyError):
+            realty['items'] = 1
+        with self.assertRaises(KeyError):
+            realty['ownershipPart']
+
+        self.assertIsInstance(xparse.parse_person('A2:A39')[0], records.Person)
+
+    
+    def test_setup_logging(self):
+        self.assertFalse(xparse.logger.handlers)
+        level = xparse.logger.level
+        with tempfile.TemporaryDirectory() as tmp:
+            log_file = os.path.join(tmp, 'xparse.log')
+            xlog.setup_logging('warning', log_file, limit=3)
+            try:
+                for num in range(10):
+                    xparse.logger.warning('Value missing at L%s?', num)
+                    xparse.logger.getChild('cache').info('not logged %s', num)
+                for num in range(5):
+                    xparse.logger.warning('%s values not in <%s>', num, 'country',
+                                          extra=xparse.NOT_RATE_LIMITED)
+                xparse.logger.error('Error %s', 1)
+            finally:
+                xlog.stop_logging()
+                xparse.logger.setLevel(level)
+            with open(log_file) as fin:
+                lines = [line.split(' ', 2)[::2] for line in fin.read().splitlines()]
+        self.assertFalse(xparse.logger.handlers)
+        self.assertEqual([msg for _, msg in lines], [
+            'Value missing at L0?', 'Value missing at L1?', 'Value missing at L2?',
+            '0 values not in <country>', '1 values not in <country>', '2 values not in <country>',
+            '3 values not in <country>', '4 values not in <country>', 'Error 1',
+            '7 more like "Value missing at L%s?"'])
+
+    
+    def test_make_valid_xml_name(self):
+        self.assertTrue(dicttoxml2.key_is_valid_xml('ownershipPart'))
+        self.assertTrue(dicttoxml2.key_is_valid_xml('квартира'))
+        self.assertFalse(dicttoxml2.key_is_valid_xml('1a'))
+        self.assertFalse(dicttoxml2.key_is_valid_xml('a b'))
+        self.assertFalse(dicttoxml2.key_is_valid_xml('a:b'))
+        self.assertFalse(dicttoxml2.key_is_valid_xml(''))
+        self.assertEqual(dicttoxml2.make_valid_xml_name('id', {}), ('id', {}))
+        self.assertEqual(dicttoxml2.make_valid_xml_name('12', {}), ('n12', {}))
+        self.assertEqual(dicttoxml2.make_valid_xml_name('a b', {}), ('a_b', {}))
+        for _ in range(2):
+            self.assertEqual(dicttoxml2.make_valid_xml_name('a<b', {}),
+                             ('key', {'name': 'a&lt;b'}))
+        dicttoxml2.set_name_validation(False)
+        try:
+            self.assertEqual(dicttoxml2.make_valid_xml_name('a b', {}), ('a b', {}))
+        finally:
+            dicttoxml2.set_name_validation(True)
+
+    
     def test_load_file(self):
         self.xlsx = xparse.load_file('data/book_100.xlsx')
         self.assertTrue(isinstance(self.xlsx, openpyxl.worksheet.worksheet.Worksheet))
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
-import cPickle
+import pickle
 import json
 import csv
 
@@ -14,11 +14,11 @@ import csv
 
 def pick_load(file_name):
     with open(file_name, 'rb') as fin:
-        return cPickle.load(fin)
+        return pickle.load(fin)
 
 def pick_save(_from, file_name):
     with open(file_name, 'wb') as fout:
-        cPickle.dump(_from, fout)
+        pickle.dump(_from, fout)
 
 
 '''Minimum edit distance
@@ -88,11 +88,77 @@ def med(target, source):
     return distance[n][m]
 
 def best_match(string, dictionary):
+    '''Key of `dictionary` closest to `string` by medd'''
     candidates = {}
-    for entry in dictionaries[dictionary].keys():
-        candidates.update({entry: utils.medd(entry, string)})
+    for entry in dictionary.keys():
+        candidates.update({entry: medd(entry, string)})
         
-    return min(candidates.iterkeys(), key=lambda k: candidates[k])
+    return min(candidates.keys(), key=lambda k: candidates[k])
+
+
+def bounded_distance(target, source, max_dist):
+    '''Levenshtein distance (unit costs) with early cutoff:
+    anything over `max_dist` is returned as max_dist + 1'''
+    n = len(target)
+    m = len(source)
+    if abs(n - m) > max_dist:
+        return max_dist + 1
+
+    previous = list(range(m + 1))
+    for i in range(1, n + 1):
+        current = [i] + [0] * m
+        char = target[i-1]
+        for j in range(1, m + 1):
+            current[j] = min(previous[j] + 1,
+                             current[j-1] + 1,
+                             previous[j-1] + (char != source[j-1]))
+        if min(current) > max_dist:
+            return max_dist + 1
+        previous = current
+    return min(previous[m], max_dist + 1)
+
+
+class BKTree(object):
+    '''Burkhard-Keller tree of words for bounded edit distance search.
+    Uses plain Levenshtein distance: unlike medd it is a metric, which
+    the tree needs to prune branches safely.'''
+
+    def __init__(self, words=()):
+        self.root = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            # the exact distance is the child key, never over the longer word
+            dist = bounded_distance(word, node[0], max(len(word), len(node[0])))
+            if dist == 0:
+                return
+            child = node[1].get(dist)
+            if child is None:
+                node[1][dist] = (word, {})
+                return
+            node = child
+
+    def search(self, word, max_dist):
+        '''(distance, word) pairs within `max_dist` of `word`, closest first.
+        Distances over max_dist plus the farthest child of a node neither
+        match nor let a child be visited, so they are cut off'''
+        found = []
+        nodes = [self.root] if self.root else []
+        while nodes:
+            node_word, children = nodes.pop()
+            dist = bounded_distance(word, node_word, max_dist + max(children, default=0))
+            if dist <= max_dist:
+                found.append((dist, node_word))
+            for child_dist, child in children.items():
+                if dist - max_dist <= child_dist <= dist + max_dist:
+                    nodes.append(child)
+        return sorted(found)
 
 
 def load_dictionaries(dicts_dir):
@@ -103,7 +169,7 @@ def load_dictionaries(dicts_dir):
         if conv:
             try:
                 return int(value)
-            except Exception, err:
+            except Exception as err:
                 #logger.error('{}. Couldn\'t convert a csv value [value] to integer'.format(value, err))
                 return value
         else:
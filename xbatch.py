@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; version 3 only.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Xbatch parses many xls files on a pool of worker processes."""
+
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import xparse
+import xcache
+import xlog
+
+logger = xparse.logger.getChild('batch') #pylint: disable=invalid-name
+
+XLS_EXTENSIONS = ('.xlsx', '.xlsm')
+
+
+def find_files(paths):
+    """Expand directories in `paths` to the xls files they contain"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(XLS_EXTENSIONS) and not name.startswith('~$'):
+                    files.append(os.path.join(path, name))
+        else:
+            files.append(path)
+    return files
+
+
+def read_manifest(manifest_file):
+    """Read (xls_file, column_range) pairs from a csv manifest with
+       `file` and optional `column_range` columns. Relative paths are
+       taken from the manifest's directory"""
+    base_dir = os.path.dirname(manifest_file)
+    jobs = []
+    with open(manifest_file, newline='') as csvfile:
+        for row in csv.DictReader(csvfile):
+            xls_file = row['file'].strip()
+            if not os.path.isabs(xls_file):
+                xls_file = os.path.join(base_dir, xls_file)
+            jobs.append((xls_file, (row.get('column_range') or '').strip() or None))
+    return jobs
+
+
+def output_dir(xls_file, save_dir):
+    """Output directory of `xls_file` under `save_dir`"""
+    return os.path.join(save_dir, os.path.splitext(os.path.basename(xls_file))[0])
+
+
+def unique_jobs(jobs):
+    """(xls_file, column_range) `jobs` without the repeated files, the
+       first job of a file kept"""
+    seen = {}
+    unique = []
+    for xls_file, column_range in jobs:
+        path = os.path.realpath(xls_file)
+        if path in seen:
+            logger.warning('Skipping %s, already listed as %s', xls_file, seen[path])
+            continue
+        seen[path] = xls_file
+        unique.append((xls_file, column_range))
+    return unique
+
+
+def output_dirs(xls_files, save_dir):
+    """Distinct output directories of `xls_files` under `save_dir`. Files
+       of the same name are told apart by their path from the common
+       directory, dir_book, and by a numeric suffix if still not unique"""
+    names = [os.path.splitext(os.path.basename(xls_file))[0] for xls_file in xls_files]
+    by_name = {}
+    for num, name in enumerate(names):
+        by_name.setdefault(name.lower(), []).append(num)
+    for nums in by_name.values():
+        if len(nums) < 2:
+            continue
+        paths = [os.path.splitext(os.path.realpath(xls_files[num]))[0] for num in nums]
+        common = os.path.commonpath([os.path.dirname(path) for path in paths])
+        for num, path in zip(nums, paths):
+            names[num] = os.path.relpath(path, common).replace(os.sep, '_')
+    used = set()
+    dirs = []
+    for name in names:
+        unique, suffix = name, 1
+        while unique.lower() in used:
+            suffix += 1
+            unique = '%s-%s' % (name, suffix)
+        used.add(unique.lower())
+        dirs.append(os.path.join(save_dir, unique))
+    return dirs
+
+
+def counted(rows, stats):
+    """Yield `rows`, counting them in stats['rows']"""
+    for row in rows:
+        stats['rows'] += 1
+        yield row
+
+
+def process_file(job):
+    """Parse one file and save it, return its stats.
+       job is (xls_file, column_range, file_dir, split_at, read_only, cache_dir),
+       file_dir being the output directory of the file, see output_dirs,
+       cache_dir None meaning no cache"""
+    xls_file, column_range, file_dir, split_at, read_only, cache_dir = job
+    cache = xcache.BlockCache(cache_dir) if cache_dir else None
+    stats = {'file':xls_file, 'range':column_range, 'rows':0,
+             'blocks':0, 'persons':0, 'seconds':0.0, 'error':None}
+    started = time.time()
+    try:
+        if column_range and not xparse.validate_dimensions(column_range):
+            raise ValueError('Wrong dimensions %s' % column_range)
+        if read_only:
+            origin, rows, layout = xparse.stream_rows(xls_file, column_range)
+            persons = xparse.iter_parse_rows(counted(rows, stats), origin, cache=cache,
+                                             layout=layout)
+        else:
+            parser = xparse.Parser(xparse.load_file(xls_file, False,
+                                                    xparse.layout_max_col(column_range or 'A2')))
+            if not column_range:
+                column_range = parser.detect_column_range()
+                if not column_range:
+                    raise ValueError('No persons found')
+            origin, end = [xparse.Coord.parse(coord) for coord in column_range.split(':')]
+            persons = xparse.iter_parse_rows(counted(parser.iter_range_rows(origin, end), stats),
+                                             origin, cache=cache, layout=parser.layout)
+        blocks_by_p = xparse.iter_related(xparse.iter_blocks(persons))
+        stats['blocks'], stats['persons'] = xparse.save_to_file(
+            blocks_by_p, split_at, file_dir, cache)
+        if not stats['rows']:
+            raise ValueError('No persons found')
+        stats['range'] = '%s:%s' % (origin, origin.shift(0, stats['rows'] - 1))
+        xparse.context.lookup.log_misses()
+    except Exception as err:
+        logger.error('Failed to process %s: %s', xls_file, err)
+        stats['error'] = str(err)
+    finally:
+        stats['seconds'] = time.time() - started
+    return stats
+
+
+def parse_batch(jobs, save_dir='out', split_at=0, workers=0, read_only=True,
+                cache_dir=None):
+    """Parse (xls_file, column_range) `jobs`, a column_range of None meaning
+       auto-detect, each into its own directory under `save_dir`, see
+       output_dirs. A file listed more than once is parsed once.
+       Blocks are cached in `cache_dir` if given.
+       Return a list of per file stats"""
+    os.makedirs(save_dir, exist_ok=True)
+    jobs = unique_jobs(jobs)
+    dirs = output_dirs([xls_file for xls_file, _ in jobs], save_dir)
+    tasks = [(xls_file, column_range, file_dir, split_at, read_only, cache_dir)
+             for (xls_file, column_range), file_dir in zip(jobs, dirs)]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(process_file, tasks))
+    else:
+        results = [process_file(task) for task in tasks]
+    if cache_dir:
+        xcache.BlockCache(cache_dir).evict()
+    return results
+
+
+def summary(results, seconds):
+    """Aggregate throughput summary of parse_batch results"""
+    done = [stats for stats in results if not stats['error']]
+    rows = sum(stats['rows'] for stats in done)
+    persons = sum(stats['persons'] for stats in done)
+    seconds = seconds or 1e-9
+    lines = ['%-40s %8s %8s %8s %s' % ('file', 'rows', 'persons', 'seconds', 'error')]
+    for stats in results:
+        lines.append('%-40s %8s %8s %8.2f %s' % (
+            os.path.basename(stats['file']), stats['rows'], stats['persons'],
+            stats['seconds'], stats['error'] or ''))
+    lines.append('Files: %s ok / %s failed. Rows: %s. Persons: %s. Time: %.2f s.' % (
+        len(done), len(results) - len(done), rows, persons, seconds))
+    lines.append('Throughput: %.2f files/s, %.0f rows/s, %.0f persons/s.' % (
+        len(done) / seconds, rows / seconds, persons / seconds))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    """
+    Example: xbatch.py data/ -s 20 -w 4
+             xbatch.py -m manifest.csv -t out
+    """
+    parser.add_argument("xls_files",
+                        help="Input xls files or directories",
+                        nargs='*')
+    parser.add_argument("-m", "--manifest",
+                        help="CSV file with `file` and `column_range` columns",
+                        type=str)
+    parser.add_argument("-c", "--column_range",
+                        help="Persons column range for all files, detected if omitted",
+                        type=str)
+    parser.add_argument("-s", "--split_at",
+                        help="Split output xml file into N blocks each",
+                        type=int,
+                        default=0)
+    parser.add_argument("-t", "--save_dir",
+                        help="Directory to save files to, one subdirectory per file",
+                        type=str, default='out')
+    parser.add_argument("-w", "--workers",
+                        help="Parse N files at once",
+                        type=int,
+                        default=os.cpu_count())
+    parser.add_argument("--no-cache", "--no_cache",
+                        help="Do not reuse or store parsed blocks",
+                        dest="no_cache",
+                        action="store_true")
+    parser.add_argument("--cache_dir",
+                        help="Directory of the parsed blocks cache",
+                        type=str, default='.xparse_cache')
+    parser.add_argument("-l", "--log_level",
+                        help="Log messages of this level and above: DEBUG, INFO, WARNING, ERROR",
+                        type=str, default='INFO')
+    parser.add_argument("--log_file",
+                        help="File to log to as well, empty for none",
+                        type=str, default='xparse.log')
+    parser.add_argument("--log_limit",
+                        help="Log at most N messages of a kind below ERROR, 0 for all",
+                        type=int, default=10)
+    ARGS = parser.parse_args()
+    xlog.setup_logging(ARGS.log_level, ARGS.log_file, ARGS.log_limit)
+
+    JOBS = [(xls_file, ARGS.column_range) for xls_file in find_files(ARGS.xls_files)]
+    if ARGS.manifest:
+        JOBS.extend(read_manifest(ARGS.manifest))
+    if not JOBS:
+        parser.error('No input files')
+
+    STARTED = time.time()
+    RESULTS = parse_batch(JOBS, ARGS.save_dir, ARGS.split_at, ARGS.workers,
+                          cache_dir=None if ARGS.no_cache else ARGS.cache_dir)
+    print(summary(RESULTS, time.time() - STARTED))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; version 3 only.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Xcache keeps parsed and mapped blocks on disk, keyed by content hash."""
+
+import hashlib
+import logging
+import os
+import pickle
+import time
+
+logger = logging.getLogger('xparse.cache') #pylint: disable=invalid-name
+
+# Bump when the layout of cached entries or the parser output changes
+CACHE_VERSION = 4
+
+
+class BlockCache(object):
+    """On-disk cache of per-block results, one pickle file per entry.
+       Entries not used for `max_age` seconds are evicted, as are the least
+       recently used ones once the cache grows over `max_size` bytes"""
+
+    def __init__(self, cache_dir='.xparse_cache', max_size=256 * 2**20,
+                 max_age=30 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(namespace, data):
+        """Hash of `data` (rows, persons...) within a `namespace`"""
+        payload = pickle.dumps((CACHE_VERSION, namespace, data), protocol=4)
+        return hashlib.sha1(payload).hexdigest()
+
+    def path(self, key):
+        """Entry file of `key`"""
+        return os.path.join(self.cache_dir, key[:2], key + '.pkl')
+
+    def get(self, key):
+        """Cached value of `key` or None"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as fin:
+                value = pickle.load(fin)
+            os.utime(path) # mark as recently used
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store `value` under `key`"""
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '%s.%s.tmp' % (path, os.getpid())
+            with open(tmp_path, 'wb') as fout:
+                pickle.dump(value, fout, protocol=4)
+            os.replace(tmp_path, path)
+        except OSError as err:
+            logger.warning('Could not write cache entry %s: %s', key, err)
+
+    def entries(self):
+        """(mtime, size, path) of all entries"""
+        found = []
+        if not os.path.isdir(self.cache_dir):
+            return found
+        for subdir in os.listdir(self.cache_dir):
+            subdir = os.path.join(self.cache_dir, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                path = os.path.join(subdir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    def evict(self):
+        """Drop entries older than max_age, then the oldest ones over max_size.
+           Return the number of removed entries"""
+        entries = sorted(self.entries())
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logger.info('Evicted %s cache entries', removed)
+        return removed
+
+    def clear(self):
+        """Remove all entries"""
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
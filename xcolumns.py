@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; version 3 only.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Xcolumns keeps parsed declarations as columns.
+
+Declarations holds the persons as parallel lists, one per field, and the
+ownership, usage and vehicle rows as flat tables of their own keyed by
+person_id, instead of a record per person with nested lists. Relations,
+mapping, xml and csv export and statistics work on whole columns; a table
+converts to a NumPy structured array if NumPy is installed.
+
+Example:
+    python3 xcolumns.py book.xlsx --csv out_csv
+"""
+
+import argparse
+import csv
+import math
+import os
+from itertools import compress, groupby
+from operator import itemgetter
+import records
+import xlog
+import xparse
+
+# Tables of the items of a person and their records
+ITEMS = (('ownership', records.Ownership),
+         ('usage', records.Usage),
+         ('vehicle', records.Vehicle))
+PERSON_FIELDS = tuple(field for field in records.Person.fields if field not in dict(ITEMS))
+
+
+def typed_memo(function, values):
+    """[function(value) for value in `values`], called once per distinct
+       value; 1 and 1.0 are different values, as for Lookup"""
+    results = {}
+    out = []
+    for value in values:
+        key = (value.__class__, value)
+        try:
+            result = results[key]
+        except KeyError:
+            result = results[key] = function(value)
+        except TypeError: # unhashable
+            result = function(value)
+        out.append(result)
+    return out
+
+
+def to_number(value):
+    """float of a number or of a numeric string like '1 234,5', None otherwise"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        try:
+            value = float(value.replace(' ', '').replace('\xa0', '').replace(',', '.'))
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return float(value)
+    return None
+
+
+def column_dtype(values):
+    """NumPy type of a column: 'i8' of integers, 'f8' of numbers and
+       None (NaN), 'O' of anything else"""
+    kind = 'i8'
+    for value in values:
+        if value is None or isinstance(value, float):
+            kind = 'f8'
+        elif not isinstance(value, int) or isinstance(value, bool):
+            return 'O'
+    return kind
+
+
+class Table(object):
+    """Rows of one kind as parallel columns, lists named by `fields`"""
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.columns = {field: [] for field in self.fields}
+
+    def __len__(self):
+        return len(self.columns[self.fields[0]])
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def append(self, values):
+        """Add a row of `values` in field order"""
+        for column, value in zip(self.columns.values(), values):
+            column.append(value)
+
+    def rows(self):
+        """Row tuples in field order"""
+        return zip(*self.columns.values())
+
+    def to_numpy(self, numeric=()):
+        """NumPy structured array of the table, the `numeric` fields
+           converted to floats with to_number. Needs NumPy"""
+        try:
+            import numpy # pylint: disable=import-outside-toplevel
+        except ImportError as err:
+            raise ImportError('Table.to_numpy needs NumPy: pip install numpy') from err
+        columns = {field: (list(map(to_number, column)) if field in numeric else column)
+                   for field, column in self.columns.items()}
+        dtype = [(field, column_dtype(columns[field])) for field in self.fields]
+        array = numpy.empty(len(self), dtype=dtype)
+        for field, kind in dtype:
+            column = columns[field]
+            if kind == 'f8':
+                column = [numpy.nan if value is None else value for value in column]
+            array[field] = column
+        return array
+
+    def write_csv(self, path):
+        """Save the table with a header row to `path`"""
+        with open(path, 'w', newline='') as fout:
+            writer = csv.writer(fout)
+            writer.writerow(self.fields)
+            writer.writerows(self.rows())
+
+
+class Declarations(object):
+    """Parsed persons as a `persons` table and `ownership`, `usage` and
+       `vehicle` tables keyed by person_id, rows in the order of the
+       persons. Person ids have to be unique, as iter_parse_rows makes them"""
+
+    def __init__(self):
+        self.persons = Table(PERSON_FIELDS)
+        for kind, record in ITEMS:
+            setattr(self, kind, Table(('person_id',) + record.fields))
+        self.related = True # whether relativeOf and relationType are set
+
+    @classmethod
+    def from_persons(cls, persons):
+        """Declarations of parsed `persons`, an iterable, see extend"""
+        declarations = cls()
+        declarations.extend(persons)
+        return declarations
+
+    def __len__(self):
+        return len(self.persons)
+
+    def tables(self):
+        """(name, Table) of the persons and of the items"""
+        return [('persons', self.persons)] + [(kind, getattr(self, kind)) for kind, _ in ITEMS]
+
+    def extend(self, persons):
+        """Add parsed `persons` (records.Person or dicts), one at a time"""
+        person_columns = [self.persons[field].append for field in PERSON_FIELDS]
+        item_tables = [(kind, [column.append for column in getattr(self, kind).columns.values()],
+                        record.fields) for kind, record in ITEMS]
+        for person in persons:
+            if self.related and 'relativeOf' not in person:
+                self.related = False
+            for append, field in zip(person_columns, PERSON_FIELDS):
+                append(person.get(field))
+            person_id = person['person_id']
+            for kind, appends, fields in item_tables:
+                for item in person[kind]:
+                    appends[0](person_id)
+                    for append, field in zip(appends[1:], fields):
+                        append(item.get(field))
+
+    def set_relations(self):
+        """relativeOf and relationType of all persons, as iter_related sets them"""
+        persons = self.persons
+        relative_of, relation_type = [], []
+        main = last_p = None
+        for num, (p, person_id, person_num, name) in enumerate(zip(
+                persons['p'], persons['person_id'], persons['person_num'], persons['name'])):
+            if num == 0 or p != last_p:
+                main, last_p = person_id, p
+            if person_num == 1:
+                relative_of.append(None)
+                relation_type.append(None)
+            else:
+                relative_of.append(main)
+                relation_type.append(name)
+        persons.columns['relativeOf'] = relative_of
+        persons.columns['relationType'] = relation_type
+        self.related = True
+
+    def block_sizes(self):
+        """Number of persons of every block, persons of a block having a common `p`"""
+        return [sum(1 for _ in group) for _, group in groupby(self.persons['p'])]
+
+    def item_groups(self, kind, make):
+        """Iterator of (person_id, [make(row), ...]) of the `kind` table,
+           `make` returning None for a row to leave out"""
+        for person_id, rows in groupby(getattr(self, kind).rows(), key=itemgetter(0)):
+            yield person_id, [item for item in map(make, rows) if item is not None]
+
+    def join(self, groups):
+        """Lists of the items of every person out of item_groups `groups`,
+           in the order of the persons"""
+        groups = list(groups)
+        pending = [next(group, None) for group in groups]
+        for person_id in self.persons['person_id']:
+            items = []
+            for num, group in enumerate(groups):
+                if pending[num] is not None and pending[num][0] == person_id:
+                    items.extend(pending[num][1])
+                    pending[num] = next(group, None)
+            yield items
+
+    def iter_persons(self):
+        """records.Person of every person, as parse_person returns them"""
+        person_fields = PERSON_FIELDS if self.related else tuple(
+            field for field in PERSON_FIELDS if field not in ('relativeOf', 'relationType'))
+        items = []
+        for kind, record in ITEMS:
+            fields = record.fields
+            items.append(self.join([self.item_groups(
+                kind, lambda row, record=record, fields=fields: record(**dict(zip(fields, row[1:]))))]))
+        for row, *person_items in zip(zip(*(self.persons[field] for field in person_fields)),
+                                      *items):
+            person = dict(zip(person_fields, row))
+            for (kind, _), kind_items in zip(ITEMS, person_items):
+                person[kind] = kind_items
+            yield records.Person(**person)
+
+    def iter_blocks(self):
+        """Lists of records.Person of every block, see xparse.iter_blocks"""
+        return xparse.iter_blocks(self.iter_persons())
+
+    def map(self, lookup=None):
+        """records.MappedPerson of every person, as map_data maps them one
+           by one, with `lookup` or the one of xparse.context. Values are
+           checked and ownership types parsed once per distinct value, so
+           unknown ownership types are logged once. Relations are set first
+           if they are not"""
+        if lookup is None:
+            lookup = xparse.context.lookup
+        if not self.related:
+            self.set_relations()
+        code = lookup.code
+        own, use, veh = self.ownership, self.usage, self.vehicle
+
+        def groups(rows):
+            """item_groups of (person_id, item) `rows`"""
+            for person_id, items in groupby(rows, key=itemgetter(0)):
+                yield person_id, [item for _, item in items]
+
+        own_types = typed_memo(lambda own_type: xparse.set_ownership({'own_type': own_type}),
+                               own['own_type'])
+        ownership = groups(
+            (person_id, records.Realty(realtyType='1',
+                                       objectType=code(obj, 'objectType'),
+                                       ownershipType=code(own_type, 'ownershipType'),
+                                       ownershipPart=own_part,
+                                       square=square,
+                                       country=code(location, 'country')))
+            for person_id, obj, (own_type, own_part), square, location in compress(
+                zip(own['person_id'], own['own_obj'], own_types, own['own_sq'],
+                    own['own_location']),
+                typed_memo(xparse.not_empty, own['own_obj'])))
+        usage = groups(
+            (person_id, records.Realty(realtyType='2',
+                                       objectType=code(obj, 'objectType'),
+                                       square=square,
+                                       country=code(location, 'country')))
+            for person_id, obj, square, location in compress(
+                zip(use['person_id'], use['use_obj'], use['use_sq'], use['use_loc']),
+                typed_memo(xparse.not_empty, use['use_obj'])))
+        transports = groups(
+            (person_id, records.Transport(transportName=item))
+            for person_id, item in compress(zip(veh['person_id'], veh['vehicle_item']),
+                                            typed_memo(xparse.not_empty, veh['vehicle_item'])))
+
+        persons = self.persons
+        incomes = typed_memo(xparse.not_empty, persons['income'])
+        mapped = []
+        for (person_id, p, start, name, position, income, has_income, relative_of,
+             relation_type, realties, person_transports) in zip(
+                 persons['person_id'], persons['p'], persons['start'], persons['name'],
+                 persons['position'], persons['income'], incomes, persons['relativeOf'],
+                 persons['relationType'], self.join([ownership, usage]),
+                 self.join([transports])):
+            if not relative_of:
+                name = xparse.set_name({'relativeOf': relative_of, 'name': name,
+                                        'p': p, 'start': start})
+            mapped.append(records.MappedPerson(
+                id=person_id,
+                name=None if relative_of else name,
+                relativeOf=relative_of,
+                relationType=code(relation_type, 'relationType'),
+                position=None if relative_of else position,
+                realties=realties or None,
+                transports=person_transports or None,
+                income=income if has_income else None,
+                incomeComment=None,
+                incomeSource=None))
+        return mapped
+
+    def mapped_blocks(self, lookup=None):
+        """Lists of the mapped persons of every block, see map"""
+        mapped = iter(self.map(lookup))
+        for size in self.block_sizes():
+            yield [next(mapped) for _ in range(size)]
+
+    def save_to_file(self, split_at=0, save_dir='out', serializer='schema', workers=0,
+                     lookup=None):
+        """Map all persons at once and save them as xparse.save_to_file does"""
+        return xparse.save_to_file(self.mapped_blocks(lookup), split_at, save_dir,
+                                   serializer=serializer, workers=workers, mapped=True)
+
+    def write_csv(self, save_dir):
+        """Save every table to `save_dir` as <name>.csv"""
+        os.makedirs(save_dir, exist_ok=True)
+        for name, table in self.tables():
+            table.write_csv(os.path.join(save_dir, name + '.csv'))
+
+    def total_area(self, kind='ownership'):
+        """Sum of the numeric squares of the 'ownership' or 'usage' rows"""
+        column = self.ownership['own_sq'] if kind == 'ownership' else self.usage['use_sq']
+        return sum(number for number in map(to_number, column) if number is not None)
+
+    def income_by_position(self):
+        """{position: {'persons', 'total', 'mean'}} of the numeric incomes
+           of the declarants, the first persons of the blocks"""
+        stats = {}
+        persons = self.persons
+        for person_num, position, income in zip(persons['person_num'], persons['position'],
+                                                map(to_number, persons['income'])):
+            if person_num != 1 or income is None:
+                continue
+            entry = stats.setdefault(position, {'persons': 0, 'total': 0.0})
+            entry['persons'] += 1
+            entry['total'] += income
+        for entry in stats.values():
+            entry['mean'] = entry['total'] / entry['persons']
+        return stats
+
+
+def report(declarations, top=10):
+    """Human readable statistics of `declarations`"""
+    lines = ['persons: %s, ownership rows: %s, usage rows: %s, vehicles: %s' % tuple(
+        len(table) for _, table in declarations.tables())]
+    lines.append('total area: ownership %.1f, usage %.1f' % (
+        declarations.total_area('ownership'), declarations.total_area('usage')))
+    by_position = sorted(declarations.income_by_position().items(),
+                         key=lambda item: item[1]['total'], reverse=True)
+    lines.append('%-50s %8s %16s %14s' % ('position', 'persons', 'income', 'mean'))
+    for position, entry in by_position[:top]:
+        lines.append('%-50s %8s %16.2f %14.2f' % (str(position)[:50], entry['persons'],
+                                                 entry['total'], entry['mean']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("xls_file", help="Input xls file")
+    parser.add_argument("-c", "--column_range",
+                        help="Persons column range, detected if omitted", type=str)
+    parser.add_argument("--layout", help="Column layout, selected by the header if omitted",
+                        type=str)
+    parser.add_argument("--csv", help="Directory to save the tables to as csv", type=str)
+    parser.add_argument("--top", help="Positions to list by income", type=int, default=10)
+    parser.add_argument("-l", "--log_level", help="Log messages of this level and above",
+                        type=str, default='WARNING')
+    ARGS = parser.parse_args()
+    xlog.setup_logging(ARGS.log_level)
+
+    DECLARATIONS = Declarations.from_persons(
+        xparse.iter_parse(ARGS.xls_file, ARGS.column_range, layout=ARGS.layout))
+    DECLARATIONS.set_relations()
+    print(report(DECLARATIONS, ARGS.top))
+    if ARGS.csv:
+        DECLARATIONS.write_csv(ARGS.csv)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; version 3 only.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Xlayout describes where the fields of a declaration are in a sheet.
+
+A layout profile is a JSON file in `layouts/`: `columns` maps every field
+to its column, counted from the numbering column (0), and `header` lists
+texts of the header cells the profile is recognized by. A profile is
+compiled into a Layout, an offset table that turns every sheet row into
+the canonical row of FIELDS the parser works on."""
+
+import json
+import os
+from collections import namedtuple
+from itertools import zip_longest
+from operator import itemgetter
+
+LAYOUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layouts')
+DEFAULT = 'mvd' # used when no profile matches the header
+HEADER_ROWS = 5 # rows above the first person searched for header texts
+MIN_SCORE = 0.5 # share of the header texts of a profile to be found
+
+# Fields of the canonical row, in its order
+FIELDS = ('number', 'name', 'position', 'income',
+          'own_obj', 'own_type', 'own_sq', 'own_location',
+          'use_obj', 'use_sq', 'use_loc',
+          'vehicle_item', 'vehicle_pay')
+REQUIRED = ('number', 'name')
+
+
+def normalize(text):
+    """Lowercase `text` with single spaces"""
+    return ' '.join(str(text).lower().split())
+
+
+class Layout(namedtuple('Layout', ['name', 'offsets', 'header'])):
+    """Compiled profile: `offsets` of the FIELDS in a sheet row, None for
+       a column the template lacks, and `header` ((offset, texts), ...)"""
+    __slots__ = ()
+
+    @property
+    def canonical(self):
+        """Whether the values are in the columns of the canonical row"""
+        return self.offsets == tuple(range(len(FIELDS)))
+
+    @property
+    def width(self):
+        """Columns of a sheet row, from the numbering column"""
+        return max(offset for offset in self.offsets if offset is not None) + 1
+
+    def column(self, index):
+        """Sheet row offset of canonical row `index`, the index itself if
+           the template lacks the column"""
+        offset = self.offsets[index]
+        return index if offset is None else offset
+
+    def remap(self, rows, width=None):
+        """Canonical rows of sheet `rows`, tuples of `width` values (the
+           layout width by default). Rows are passed as they are when the
+           offsets are those of the canonical row"""
+        if self.canonical and (width or self.width) == len(FIELDS):
+            return rows
+        getter = itemgetter(*[-1 if offset is None else offset for offset in self.offsets])
+        if None in self.offsets:
+            return (getter(row + (None,)) for row in rows)
+        return map(getter, rows)
+
+    def score(self, texts):
+        """Share of the header texts of the layout found in `texts`, the
+           normalized header text of every column"""
+        if not self.header:
+            return 0.0
+        found = sum(1 for offset, names in self.header
+                    if offset < len(texts) and any(name in texts[offset] for name in names))
+        return found / len(self.header)
+
+
+def compile_layout(name, profile):
+    """Layout of a `profile` {'columns': {field: offset}, 'header': {field: texts}},
+       raise ValueError if it is not a valid one"""
+    columns = profile.get('columns', {})
+    unknown = sorted(set(columns) - set(FIELDS))
+    if unknown:
+        raise ValueError('Layout %s: unknown fields %s' % (name, ', '.join(unknown)))
+    missing = [field for field in REQUIRED if columns.get(field) is None]
+    if missing:
+        raise ValueError('Layout %s: no column of %s' % (name, ', '.join(missing)))
+    if columns['number'] != 0:
+        raise ValueError('Layout %s: number must be column 0' % name)
+    offsets = tuple(columns.get(field) for field in FIELDS)
+    used = [offset for offset in offsets if offset is not None]
+    if (any(not isinstance(offset, int) or offset < 0 for offset in used)
+            or len(set(used)) != len(used)):
+        raise ValueError('Layout %s: columns must be distinct non-negative integers' % name)
+
+    header = []
+    for field, texts in sorted(profile.get('header', {}).items()):
+        if columns.get(field) is None:
+            raise ValueError('Layout %s: header of %s, which has no column' % (name, field))
+        if isinstance(texts, str):
+            texts = [texts]
+        header.append((columns[field], tuple(normalize(text) for text in texts)))
+    return Layout(name, offsets, tuple(header))
+
+
+def load_layout(path):
+    """Layout of the profile file `path`, named after the file"""
+    with open(path, 'r') as file_in:
+        profile = json.load(file_in)
+    return compile_layout(os.path.splitext(os.path.basename(path))[0], profile)
+
+
+def load_layouts(layouts_dir=LAYOUTS_DIR):
+    """{name: Layout} of all profiles in `layouts_dir`"""
+    return {layout.name: layout for layout in
+            (load_layout(os.path.join(layouts_dir, file_name))
+             for file_name in sorted(os.listdir(layouts_dir)) if file_name.endswith('.json'))}
+
+
+def header_texts(rows):
+    """Normalized text of every column of the header `rows`, the values
+       of a column joined"""
+    return [normalize(' '.join(str(value) for value in column if value is not None))
+            for column in zip_longest(*rows)]
+
+
+def select(layouts, rows):
+    """(layout, score) of the `layouts` matching the header `rows` best,
+       the first one by name on a tie; (None, 0.0) without layouts"""
+    texts = header_texts(rows)
+    best, best_score = None, 0.0
+    for layout in sorted(layouts, key=lambda layout: layout.name):
+        score = layout.score(texts)
+        if best is None or score > best_score:
+            best, best_score = layout, score
+    return best, best_score
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; version 3 only.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Xlog sets up queue based logging of the xparse loggers.
+
+Records are put on a queue by the parsing thread and written to the
+console and the log file by a listener thread. Messages below ERROR are
+rate limited per message template, the number of the dropped ones is
+logged when logging stops. Nothing is set up on import, see setup_logging."""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+from collections import Counter
+
+FORMAT_CONSOLE = '[%(levelname)s] %(message)s'
+FORMAT_FILE = '[%(levelname)s] %(asctime)s %(message)s'
+
+state = {} #pylint: disable=invalid-name
+
+
+class RateLimit(logging.Filter):
+    """Let through the first `limit` records of every message template
+       below ERROR, count the others. Records logged with
+       extra={'rate_limit': False} always pass"""
+
+    def __init__(self, limit=10):
+        super().__init__()
+        self.limit = limit
+        self.counts = Counter()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR or not getattr(record, 'rate_limit', True):
+            return True
+        key = (record.name, record.levelno, record.msg)
+        self.counts[key] += 1
+        return self.counts[key] <= self.limit
+
+    def summary(self):
+        """Records telling how many records of each template were dropped"""
+        for (name, levelno, msg), count in sorted(self.counts.items(), key=str):
+            if count > self.limit:
+                yield logging.LogRecord(name, levelno, __file__, 0,
+                                        '%s more like "%s"', (count - self.limit, msg), None)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler of a process. In a forked worker, where the listener
+       thread does not run, records go straight to the `handlers`"""
+
+    def __init__(self, records, handlers):
+        super().__init__(records)
+        self.handlers = handlers
+        self.pid = os.getpid()
+
+    def emit(self, record):
+        if os.getpid() == self.pid:
+            super().emit(record)
+            return
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def setup_logging(level='INFO', log_file=None, limit=10, name='xparse'):
+    """Log records of `name` and its children at `level` and above to the
+       console and to `log_file` if given, through a queue listener.
+       With `limit` only that many records of every message template below
+       ERROR are written. Return the logger"""
+    stop_logging()
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(fmt=FORMAT_CONSOLE))
+    handlers = [console]
+    if log_file:
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(logging.Formatter(fmt=FORMAT_FILE, datefmt='%H:%M:%S'))
+        handlers.append(file_handler)
+    for handler in handlers:
+        handler.setLevel(level)
+
+    handler = QueueHandler(queue.SimpleQueue(), handlers)
+    if limit:
+        handler.addFilter(RateLimit(limit))
+    listener = logging.handlers.QueueListener(handler.queue, *handlers,
+                                              respect_handler_level=True)
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    listener.start()
+    if not state:
+        atexit.register(stop_logging)
+    state.update(logger=logger, handler=handler, listener=listener)
+    return logger
+
+
+def stop_logging():
+    """Log the rate limit summary, write out the queued records and remove
+       the handlers of setup_logging"""
+    handler = state.get('handler')
+    if handler is None:
+        return
+    for rate_limit in handler.filters:
+        for record in rate_limit.summary():
+            if state['logger'].isEnabledFor(record.levelno):
+                handler.queue.put_nowait(record)
+    state['listener'].stop()
+    state['logger'].removeHandler(handler)
+    for target in handler.handlers:
+        target.close()
+    state['handler'] = None
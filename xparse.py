@@ -21,30 +21,36 @@ import re
 import os
 import logging
 import json
-from collections import OrderedDict
-import openpyxl
-from dicttoxml2 import dicttoxml2
+import hashlib
+import sys
+import threading
+from collections import Counter, OrderedDict, deque, namedtuple
+from functools import lru_cache
+from itertools import chain, compress, groupby, islice
+from operator import itemgetter
+from dicttoxml2 import dicttoxml3
+import xcache
+import xlog
+import records
+import xschema
+import xlayout
+import utils
 #from string import punctuation
 
-#logging config:
-logger = logging.getLogger(__name__) #pylint: disable=invalid-name
-logger.setLevel(logging.DEBUG)
-fh = logging.FileHandler('xparse.log') #pylint: disable=invalid-name
-ch = logging.StreamHandler() #pylint: disable=invalid-name
-formatter_ch = logging.Formatter(fmt='[%(levelname)s] %(message)s') #pylint: disable=invalid-name
-formatter_fh = logging.Formatter(fmt='[%(levelname)s] %(asctime)s %(message)s', datefmt='%H:%M:%S') #pylint: disable=invalid-name
-ch.setFormatter(formatter_ch)
-fh.setFormatter(formatter_fh)
-ch.setLevel(logging.INFO)
-fh.setLevel(logging.DEBUG)
-logger.addHandler(ch)
-logger.addHandler(fh)
-#logging config.
+# Logging is set up by the caller, see xlog.setup_logging
+logger = logging.getLogger('xparse') #pylint: disable=invalid-name
+NOT_RATE_LIMITED = {'rate_limit': False} # extra of aggregated messages
 
 # Some globals
-# Load dictionaries for objects
-with open('dictionaries.json', 'r') as file_in:
-    dictionaries = json.load(file_in) #pylint: disable=invalid-name
+# Dictionaries for objects, next to this module whatever the cwd is
+DICTIONARIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dictionaries.json')
+
+# Columns of a declaration row, counted from the persons (numbering) column:
+# number, name, position, income, 4 x ownership, 3 x usage, 2 x vehicle
+LAYOUT_WIDTH = 13
+
+# Stripped off the numbering, e.g. '12.' or '(12)'
+UNWANTED_CHARS = '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~ '
 
 ############################
 # General helper functions
@@ -52,7 +58,7 @@ with open('dictionaries.json', 'r') as file_in:
 
 def get_sorted_coord(coord_lst):
     """Sort alphanum coordinates"""
-    return sorted(coord_lst, key=lambda x: int(re.findall(r'\d+$', x)[0]))
+    return sorted(coord_lst, key=lambda x: Coord.parse(x).row)
 
 
 def validate_dimensions(dimensions):
@@ -61,21 +67,266 @@ def validate_dimensions(dimensions):
     return bool(valid.match(dimensions))
 
 
-def value_from_dict(value, dictionary='none_values'):
-    """Get a dictionary values"""
+@lru_cache(maxsize=None)
+def col_to_index(col):
+    """Column letters to 1-based index: A -> 1, AA -> 27"""
+    index = 0
+    for letter in col:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index
+
+
+@lru_cache(maxsize=None)
+def index_to_col(index):
+    """1-based column index to letters: 1 -> A, 27 -> AA"""
+    col = ''
+    while index > 0:
+        index, rest = divmod(index - 1, 26)
+        col = chr(rest + ord('A')) + col
+    return col
+
+
+class Coord(namedtuple('Coord', ['row', 'col'])):
+    """Cell coordinate as 1-based (row, col) integers.
+       Compares and sorts by row, then column; str() gives `B12`"""
+    __slots__ = ()
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def parse(coord):
+        """`B12` -> Coord(row=12, col=2), raise ValueError if invalid"""
+        coord = coord.upper()
+        col = coord.rstrip('0123456789')
+        row = coord[len(col):]
+        if not col or not row or not all('A' <= letter <= 'Z' for letter in col):
+            raise ValueError('Invalid coordinate: %s' % coord)
+        return Coord(int(row), col_to_index(col))
+
+    def shift(self, step=1, rows=0):
+        """Coordinate `step` columns to the right and `rows` down"""
+        return Coord(self.row + rows, self.col + step)
+
+    def __str__(self):
+        return index_to_col(self.col) + str(self.row)
+
+
+def layout_max_col(column_range, layout=None, context=None):
+    """Last column index read for the persons starting at `column_range`,
+       by the width of `layout` (a profile name or file or an xlayout.Layout)
+       or, without one, of the widest profile of `context`, the process one
+       by default"""
+    if context is None:
+        context = process_context()
+    width = context.max_width if layout is None else context.layout(layout).width
+    return Coord.parse(column_range.split(':')[0]).col + width - 1
+
+
+class Lookup(object):
+    """Code lookups in `dictionaries`. Keys are normalized and interned once,
+       results are memoized in a bounded LRU and misses are counted per
+       dictionary instead of being logged one by one, see log_misses.
+       With `fuzzy` > 0 a miss in one of FUZZY_DICTIONARIES is resolved to the
+       closest key within that many edits, see set_fuzzy"""
+
+    FUZZY_DICTIONARIES = ('objectType', 'ownershipType', 'country', 'relationType')
+
+    def __init__(self, dicts, cache_size=4096, fuzzy=0):
+        # a key that changes when normalized can never be found, leave it out
+        self.index = {
+            name: {sys.intern(key): code for key, code in entries.items()
+                   if key == self.normalize(key)}
+            for name, entries in dicts.items()}
+        self.misses = {}
+        self.fuzzy_matches = {}
+        self.fuzzy = fuzzy
+        self.trees = {}
+        self.find = lru_cache(maxsize=cache_size, typed=True)(self._find)
+
+    def set_fuzzy(self, max_dist):
+        """Resolve misses within `max_dist` edits, 0 to turn off"""
+        self.fuzzy = max_dist
+        self.find.cache_clear()
+
+    def closest(self, key, dictionary):
+        """Code of the only closest key of `dictionary`, None if there is none
+           or closest keys have different codes. Short keys allow fewer edits"""
+        max_dist = min(self.fuzzy, len(key) // 5)
+        if not max_dist or dictionary not in self.FUZZY_DICTIONARIES:
+            return None
+        if dictionary not in self.trees:
+            self.trees[dictionary] = utils.BKTree(self.index[dictionary])
+        found = self.trees[dictionary].search(key, max_dist)
+        if not found:
+            return None
+        codes = set(self.index[dictionary][word] for dist, word in found if dist == found[0][0])
+        if len(codes) > 1:
+            return None
+        self.fuzzy_matches.setdefault(dictionary, Counter())[(key, found[0][1])] += 1
+        return codes.pop()
+
+    @staticmethod
     def normalize(value):
         """Normalize input value"""
-        value = value.lower().strip()
-        return value
+        return value.lower().strip()
 
-    if value is None:
-        return value
-    try:
-        return dictionaries[dictionary][normalize(value)]
-    except Exception:
-        logger.warning('"%s" not in <%s>', value, dictionary)
+    def _find(self, value, dictionary):
+        """(True, code) or (False, None)"""
+        try:
+            key = self.normalize(value)
+            return True, self.index[dictionary][key]
+        except (KeyError, AttributeError):
+            if self.fuzzy and isinstance(value, str) and dictionary in self.index:
+                code = self.closest(key, dictionary)
+                if code is not None:
+                    return True, code
+            return False, None
+
+    def code(self, value, dictionary='none_values'):
+        """Code of `value` in `dictionary` or `value` itself if not found"""
+        if value is None:
+            return value
+        try:
+            found, code = self.find(value, dictionary)
+        except TypeError: # unhashable
+            found, code = self._find(value, dictionary)
+        if found:
+            return code
+        self.misses.setdefault(dictionary, Counter())[value] += 1
         return value
 
+    def log_misses(self, reset=True):
+        """Log one warning per dictionary with the values not found in it"""
+        for dictionary, values in sorted(self.misses.items()):
+            logger.warning('%s values not in <%s>: %s', sum(values.values()), dictionary,
+                           ', '.join('"%s" (%s)' % item for item in values.most_common(10)),
+                           extra=NOT_RATE_LIMITED)
+        for dictionary, matches in sorted(self.fuzzy_matches.items()):
+            logger.info('%s fuzzy matches in <%s>: %s', len(matches), dictionary,
+                        ', '.join('"%s" -> "%s"' % match for match, _ in matches.most_common(10)),
+                        extra=NOT_RATE_LIMITED)
+        if reset:
+            self.misses = {}
+            self.fuzzy_matches = {}
+
+    def take_misses(self):
+        """(misses, fuzzy_matches) counted so far, counting starting anew,
+           see add_misses"""
+        taken = self.misses, self.fuzzy_matches
+        self.misses, self.fuzzy_matches = {}, {}
+        return taken
+
+    def add_misses(self, taken):
+        """Count the (misses, fuzzy_matches) of take_misses again"""
+        for counts, more in zip((self.misses, self.fuzzy_matches), taken):
+            for dictionary, values in more.items():
+                counts.setdefault(dictionary, Counter()).update(values)
+
+
+class Context(object):
+    """What parsing needs beyond the rows, loaded on first use: the
+       dictionaries from `dictionaries_file`, their lookup and its digest,
+       and the layout profiles of `layouts_dir`.
+       The module `context` is the one of the process, forked workers
+       inherit it as it is"""
+
+    def __init__(self, dictionaries_file=DICTIONARIES_FILE, layouts_dir=xlayout.LAYOUTS_DIR):
+        self.dictionaries_file = dictionaries_file
+        self.layouts_dir = layouts_dir
+        self._dictionaries = None
+        self._lookup = None
+        self._digest = None
+        self._layouts = None
+
+    @property
+    def dictionaries(self):
+        """Dictionaries for objects"""
+        if self._dictionaries is None:
+            with open(self.dictionaries_file, 'r') as file_in:
+                self._dictionaries = json.load(file_in)
+        return self._dictionaries
+
+    @property
+    def lookup(self):
+        """Lookup of the dictionaries"""
+        if self._lookup is None:
+            self._lookup = Lookup(self.dictionaries)
+        return self._lookup
+
+    def __getstate__(self):
+        """State sent to worker processes, the Lookup and its memo are
+           built again there with the same fuzzy setting"""
+        state = self.__dict__.copy()
+        state['_lookup'] = None
+        state['fuzzy'] = self._lookup.fuzzy if self._lookup is not None else 0
+        return state
+
+    def __setstate__(self, state):
+        fuzzy = state.pop('fuzzy')
+        self.__dict__.update(state)
+        if fuzzy:
+            self.lookup.set_fuzzy(fuzzy)
+
+    def digest(self):
+        """Hash of the dictionaries, mapped blocks depend on them"""
+        if self._digest is None:
+            self._digest = hashlib.sha1(json.dumps(self.dictionaries, sort_keys=True)
+                                        .encode('utf-8')).hexdigest()
+        return self._digest
+
+    @property
+    def layouts(self):
+        """{name: xlayout.Layout} of the layout profiles"""
+        if self._layouts is None:
+            self._layouts = xlayout.load_layouts(self.layouts_dir)
+        return self._layouts
+
+    def layout(self, layout):
+        """xlayout.Layout of a profile name or file, a Layout as it is"""
+        if isinstance(layout, xlayout.Layout):
+            return layout
+        if layout.endswith('.json'):
+            return xlayout.load_layout(layout)
+        if layout not in self.layouts:
+            raise ValueError('Unknown layout %s, known: %s'
+                             % (layout, ', '.join(sorted(self.layouts))))
+        return self.layouts[layout]
+
+    def select_layout(self, header_rows, layouts=None):
+        """Layout profile of `layouts`, all by default, matching the
+           `header_rows`, the default one if none does"""
+        layout, score = xlayout.select(self.layouts.values() if layouts is None else layouts,
+                                       header_rows)
+        if layout is None or score < xlayout.MIN_SCORE:
+            logger.info('No layout matches the header, using %s', xlayout.DEFAULT)
+            return self.layout(xlayout.DEFAULT)
+        logger.info('Layout %s matches the header (%.0f%%)', layout.name, score * 100)
+        return layout
+
+    @property
+    def max_width(self):
+        """Columns to read when the layout is not known yet"""
+        return max(layout.width for layout in self.layouts.values())
+
+
+context = Context() #pylint: disable=invalid-name
+
+
+def process_context():
+    """`context` of the process"""
+    return context
+
+
+def __getattr__(name):
+    """`dictionaries` and `lookup` of the module are the ones of `context`"""
+    if name in ('dictionaries', 'lookup'):
+        return getattr(context, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def value_from_dict(value, dictionary='none_values'):
+    """Get a dictionary values"""
+    return context.lookup.code(value, dictionary)
+
 
 def not_empty(val):
     """Check value for empty and unwanted values"""
@@ -102,74 +353,516 @@ def not_empty(val):
 # Collect data and parse persons
 #######################################
 
-def parse_person(column_range):
-    """Parse a person from a slot"""
-    try:
+# Row tuple layout, indices counted from the persons (numbering) column
+NUMBER = 0
+NAME = 1
+POSITION = 2
+INCOME = 3
+OWNERSHIP = slice(4, 8)
+USAGE = slice(8, 11)
+VEHICLE = slice(11, 13)
+
+
+ws = None #pylint: disable=invalid-name # sheet of the module level functions, see Parser
+
+
+class Parser(object):
+    """Parser of the declarations of one worksheet, `worksheet` being an
+       openpyxl sheet or a ValueSheet. The sheet, the `context`
+       (dictionaries, the process one by default) and the `layout` are its
+       own, so parsers of different workbooks can run side by side in
+       threads. The layout is a profile name or file or an xlayout.Layout,
+       without one it is selected by the header, see select_layout"""
+
+    def __init__(self, worksheet, context=None, layout=None):
+        self.ws = worksheet
+        self.context = context if context is not None else process_context()
+        self.layout = self.context.layout(layout) if layout is not None else None
+
+    @property
+    def width(self):
+        """Columns read from the numbering column"""
+        if self.layout is None:
+            return self.context.max_width
+        return self.layout.width
+
+    def header_rows(self, column=1):
+        """(rows, found): the header rows above the first numbered row of
+           `column` (an index), at most xlayout.HEADER_ROWS of them, and
+           whether there is a numbered row"""
+        header = deque(maxlen=xlayout.HEADER_ROWS)
+        rows = self.ws.iter_rows(min_row=1, max_row=self.ws.max_row, min_col=column,
+                                 max_col=column + self.width - 1, values_only=True)
+        for row in rows:
+            if is_numbering(row[NUMBER]):
+                return header, True
+            header.append(row)
+        return header, False
+
+    def select_layout(self, column=1):
+        """Layout of the sheet, selected by the header rows above the
+           first numbered row of `column` (an index) unless already known"""
+        if self.layout is None:
+            self.layout = self.context.select_layout(self.header_rows(column)[0])
+        return self.layout
+
+    def slot_layout(self, column):
+        """Layout of the sheet for person slots whose name column is `column`
+           (an index) unless already known. Every profile puts the numbering
+           left of it by its own name offset; the best header match among
+           those numbered columns wins"""
+        if self.layout is None:
+            best = None
+            offsets = set(layout.column(NAME) for layout in self.context.layouts.values())
+            for offset in sorted(offsets):
+                if column - offset < 1:
+                    continue
+                header, found = self.header_rows(column - offset)
+                if not found:
+                    continue
+                layouts = [layout for layout in self.context.layouts.values()
+                           if layout.column(NAME) == offset]
+                score = xlayout.select(layouts, header)[1]
+                if best is None or score > best[0]:
+                    best = score, header, layouts
+            if best is None:
+                self.layout = self.context.select_layout(())
+            else:
+                self.layout = self.context.select_layout(best[1], best[2])
+        return self.layout
+
+    def parse_person(self, column_range=None, workers=0, cache=None):
+        """Parse a person from a slot.
+           Without `column_range` it is detected, see detect_column_range.
+           With `workers` > 1 blocks are parsed in a pool of processes.
+           With a `cache` (xcache.BlockCache) unchanged blocks are not parsed again"""
+        return list(self.iter_persons(column_range, workers, cache))
+
+    def iter_persons(self, column_range=None, workers=0, cache=None, executor=None):
+        """Persons of the sheet, parsed lazily, see parse_person and
+           iter_parse_rows. No persons if the sheet has no numbered rows, as
+           with stream_rows; raise ValueError for an invalid `column_range`"""
+        if column_range is None:
+            column_range = self.detect_column_range()
+            if column_range is None: # logged by detect_column_range
+                return iter(())
+        if not validate_dimensions(column_range):
+            raise ValueError('Invalid column range %s' % column_range)
         start, end = column_range.split(':')
         logger.info('Parsing persons from %s to %s', start, end)
-    except Exception as err:
-        logger.error('Invalid column range, %s', err)
 
-    unwanted_chars = '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~ '
-    parsed_persons = []
-    a_slots = get_slot(start, end)
-    person_id = 1
+        start, end = Coord.parse(start), Coord.parse(end)
+        layout = self.select_layout(start.col)
+        return iter_parse_rows(self.iter_range_rows(start, end), start, workers, cache, layout,
+                               executor)
+
+    def detect_column_range(self, column='A'):
+        """Detect the persons range in `column` with a single scan of the sheet:
+           from the first numbered row below the header to the last row with
+           any value in the layout columns, so the last block is not cut.
+           Return e.g. 'A2:A787' or None if there are no numbered rows"""
+        min_col = col_to_index(column.upper())
+        first_row = last_row = None
+        rows = self.ws.iter_rows(min_row=1, max_row=self.ws.max_row, min_col=min_col,
+                                 max_col=min_col + self.width - 1, values_only=True)
+        for row_num, row in enumerate(rows, 1):
+            if first_row is None:
+                if is_numbering(row[NUMBER]):
+                    first_row = last_row = row_num
+            elif any(not_false_empty(val) for val in row):
+                last_row = row_num
+        if first_row is None:
+            logger.error('No numbered rows found in column %s', column)
+            return None
+        column_range = '%s:%s' % (Coord(first_row, min_col), Coord(last_row, min_col))
+        logger.info('Detected persons range %s', column_range)
+        return column_range
+
+    def iter_range_rows(self, start, end, width=None):
+        """Yield rows from /start/ to /end/ Coord as tuples of `width` values
+           beginning with the /start/ column. Without `width` rows of the
+           layout are read and yielded as canonical rows, see xlayout"""
+        if width is not None:
+            return self.ws.iter_rows(min_row=start.row, max_row=end.row, min_col=start.col,
+                                     max_col=start.col + width - 1, values_only=True)
+        layout = self.select_layout(start.col)
+        rows = self.ws.iter_rows(min_row=start.row, max_row=end.row, min_col=start.col,
+                                 max_col=start.col + layout.width - 1, values_only=True)
+        return layout.remap(rows)
+
+    def read_rows(self, start, end, width=None):
+        """Read rows from /start/ to /end/ Coord once, see iter_range_rows"""
+        return list(self.iter_range_rows(start, end, width))
+
+    def get_slot(self, start, end):
+        """Given /start/ and /end/ coordinates of a range, get all slots,
+           i.e. assumed range till the next slot"""
+        start, end = Coord.parse(start), Coord.parse(end)
+        data = []
+        for a_start, a_end, value in get_row_slots(self.read_rows(start, end, width=1), 0):
+            data.append({
+                'start':str(start.shift(0, a_start)),
+                'value':value,
+                'end':str(start.shift(0, a_end))
+                })
+        return data
+
+    def slot_rows(self, person_slot):
+        """Declaration rows of a person slot and their origin, see read_rows"""
+        name_col = self.slot_layout(Coord.parse(person_slot['start']).col).column(NAME)
+        start = Coord.parse(person_slot['start']).shift(-name_col)
+        end = Coord.parse(person_slot['end']).shift(-name_col)
+        return self.read_rows(start, end), start
+
+    def parse_ownership(self, person_slot):
+        """person_slot is dict"""
+        return ownership_from_rows(*self.slot_rows(person_slot), layout=self.layout)
+
+    def parse_usage(self, person_slot):
+        """Parse 'use_*' columns"""
+        return usage_from_rows(*self.slot_rows(person_slot), layout=self.layout)
+
+    def parse_vehicle(self, person_slot):
+        """Parse 'vehicle_*' columns"""
+        return vehicle_from_rows(*self.slot_rows(person_slot), layout=self.layout)
+
+    def map_data(self, person_data):
+        """map_data with the dictionaries of the parser"""
+        return map_data(person_data, self.context.lookup)
+
+    def save_to_file(self, blocks_of_data, *args, **kwargs):
+        """save_to_file mapping with the dictionaries of the parser"""
+        return save_to_file(blocks_of_data, *args, context=self.context, **kwargs)
+
+
+# Functions of the module level sheet `ws`, kept for the callers of the
+# time before Parser
+
+def parse_person(column_range=None, workers=0, cache=None):
+    """Parser.parse_person of `ws`"""
+    return Parser(ws).parse_person(column_range, workers, cache)
+
+
+def iter_persons(column_range=None, workers=0, cache=None):
+    """Parser.iter_persons of `ws`"""
+    return Parser(ws).iter_persons(column_range, workers, cache)
+
+
+def is_numbering(val):
+    """Check whether a value looks like a person number: 1, 1.0, '1.', '(1)'"""
+    if isinstance(val, bool):
+        return False
+    if isinstance(val, (int, float)):
+        return True
+    if isinstance(val, str):
+        return val.strip(UNWANTED_CHARS).isdigit()
+    return False
+
+
+def detect_column_range(column='A'):
+    """Parser.detect_column_range of `ws`"""
+    return Parser(ws).detect_column_range(column)
+
+
+def iter_range_rows(start, end, width=None):
+    """Parser.iter_range_rows of `ws`"""
+    return Parser(ws).iter_range_rows(start, end, width)
+
+
+def read_rows(start, end, width=None):
+    """Parser.read_rows of `ws`"""
+    return Parser(ws).read_rows(start, end, width)
+
+
+def stream_rows(xls_file, column_range=None, column='A', layout=None, context=None):
+    """Open `xls_file` read-only and return (origin, rows, layout): the Coord
+       of the first persons row, a generator of the canonical rows from it,
+       read from the file as they are consumed, and the xlayout.Layout of
+       the sheet. Without `column_range` persons start at the first numbered
+       row of `column` and end at the last row with values, as
+       detect_column_range finds them. Without `layout` it is selected by
+       the header rows, see Parser"""
+    import openpyxl # pylint: disable=import-outside-toplevel
+    context = context if context is not None else process_context()
+    layout = context.layout(layout) if layout is not None else None
+    width = layout.width if layout is not None else context.max_width
+    logger.info('Streaming data from %s...', xls_file)
+    workbook = openpyxl.load_workbook(xls_file, read_only=True)
+    worksheet = workbook[workbook.sheetnames[0]]
+    if column_range:
+        start, end = [Coord.parse(coord) for coord in column_range.split(':')]
+        min_row = start.row if layout is not None else max(1, start.row - xlayout.HEADER_ROWS)
+    else:
+        start, end = Coord(1, col_to_index(column.upper())), None
+        min_row = 1
+    rows = worksheet.iter_rows(min_row=min_row, max_row=end.row if end else None,
+                               min_col=start.col, max_col=start.col + width - 1,
+                               values_only=True)
+    header = deque(maxlen=xlayout.HEADER_ROWS)
+    first = None
+    if column_range:
+        header.extend(islice(rows, start.row - min_row))
+        first = next(rows, None)
+    else:
+        for row_num, row in enumerate(rows, start.row):
+            if is_numbering(row[NUMBER]):
+                start, first = Coord(row_num, start.col), row
+                break
+            header.append(row)
+    if layout is None:
+        layout = context.select_layout(header)
+    if first is None:
+        logger.error('No numbered rows found in %s', column_range or 'column %s' % column)
+        workbook.close()
+        return start, iter(()), layout
+
+    def generate():
+        """Sheet rows, padded to `width`; without column_range empty
+           rows are held back till a row with values follows"""
+        empty = []
+        try:
+            for row in chain([first], rows):
+                if len(row) < width:
+                    row = tuple(row) + (None,) * (width - len(row))
+                if column_range is None:
+                    if not any(not_false_empty(val) for val in row):
+                        empty.append(row)
+                        continue
+                    if empty:
+                        yield from empty
+                        empty = []
+                yield row
+        finally:
+            workbook.close()
+
+    return start, layout.remap(generate(), width), layout
+
+
+def iter_parse(xls_file, column_range=None, workers=0, cache=None, layout=None,
+               executor=None):
+    """Persons of `xls_file` streamed from the file, see stream_rows and
+       iter_parse_rows. Memory is bounded by a block of rows and, with
+       `workers`, by a batch of blocks"""
+    origin, rows, layout = stream_rows(xls_file, column_range, layout=layout)
+    return iter_parse_rows(rows, origin, workers, cache, layout, executor)
+
+
+def parse_rows(rows, origin=Coord(1, 1), workers=0, cache=None, layout=None):
+    """Parse declaration rows (see read_rows) into a list of persons,
+       see iter_parse_rows"""
+    return list(iter_parse_rows(rows, origin, workers, cache, layout))
+
+
+def iter_row_blocks(rows):
+    """Yield (offset, rows) of every numbered block of `rows`, a block
+       lasting till the next non-empty number. Rows before the first
+       number are dropped, only one block is held at a time"""
+    block = None
+    for num, row in enumerate(rows):
+        if not_false_empty(row[NUMBER]):
+            if block is not None:
+                yield a_start, block
+            a_start, block = num, [row]
+        elif block is not None:
+            block.append(row)
+    if block is not None:
+        yield a_start, block
+
+
+def iter_block_jobs(rows, origin, layout=None):
+    """Yield a parse_block_job for every numbered block of `rows`"""
     p = 0
-    # a_slots = [{A2, A17, 1}, {A18, A29, 2}]
-    for a_slot in a_slots:
-        # a_slot = {A2, A17, 1}
-        b_start = shift_col(a_slot['start'])
-        b_end = shift_col(a_slot['end'])
-        b_slots = get_slot(b_start, b_end)
-        p_raw = str(a_slot['value'])
+    for a_start, block in iter_row_blocks(rows):
+        p_raw = str(block[0][NUMBER])
 
         try:
-            p_raw_int = int(p_raw.strip(unwanted_chars))
+            p_raw_int = int(p_raw.strip(UNWANTED_CHARS))
         except ValueError as err:
             logger.warning('Strange P numbering: %s', p_raw)
-            p_raw_int = p_raw.strip(unwanted_chars)
+            p_raw_int = p_raw.strip(UNWANTED_CHARS)
 
-        person_num = 1
         p += 1
-        if not ws[b_start].value:
-            logger.warning('Person at %s <%s>.', b_start, ws[b_start].value)
-        else:
-            for b_slot in b_slots:
-                #if b['start'] b_slot['value']
-                try:
-                    position_coord = shift_col(b_slot['start'])
-                    position = ws[position_coord].value
-                    income_coord = shift_col(position_coord)
-                    income = ws[income_coord].value
-                    p_start = b_slot['start']
-                    p_end = b_slot['end']
-                    p_name = b_slot['value']
-                    parsed_persons.append({
-                        'p_raw':p_raw_int,
-                        'p':p,
-                        'person_id':person_id,
-                        'person_num':person_num,
-                        'start':p_start,
-                        'end': p_end,
-                        'name': p_name,
-                        'position': position,
-                        'income': income,
-                        'ownership':parse_ownership(b_slot),
-                        'usage':parse_usage(b_slot),
-                        'vehicle':parse_vehicle(b_slot)
-                        })
+        if not block[0][NAME]:
+            logger.warning('Person at %s <%s>.', origin.shift(sheet_column(layout, NAME), a_start),
+                           block[0][NAME])
+            continue
+        yield (block, origin.shift(0, a_start), p_raw_int, p, layout)
+
+
+def process_pool(workers):
+    """ProcessPoolExecutor of `workers` processes, None for less than two"""
+    if workers < 2:
+        return None
+    from concurrent.futures import ProcessPoolExecutor # pylint: disable=import-outside-toplevel
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def iter_parse_rows(rows, origin=Coord(1, 1), workers=0, cache=None, layout=None,
+                    executor=None):
+    """Single pass over declaration rows, an iterable, `origin` being
+       the Coord of the first row's NUMBER cell in the sheet. Rows are
+       canonical ones, `layout` (xlayout.Layout) telling the sheet columns
+       of their values, see sheet_column. Persons are
+       yielded block by block as the rows are read.
+       Blocks are independent, so with `workers` > 1 batches of them are
+       sent to a process pool and yielded back in `p` order, to `executor`
+       if given, one shared with save_to_file.
+       Blocks whose rows are found in `cache` are taken from it"""
+    jobs = iter_block_jobs(rows, origin, layout)
+    batch_size = max(1, workers) * 16
+    own_executor = executor is None
+    if own_executor:
+        executor = process_pool(workers)
+    person_id = 1
+    parsed_count = cached_count = 0
+    mismatch = False
+    try:
+        while True:
+            batch = list(islice(jobs, batch_size))
+            if not batch:
+                break
+            blocks = [None] * len(batch)
+            job_function = parse_block_job
+            if cache is not None:
+                job_function = captured_block_job
+                if layout is None or layout.canonical:
+                    keys = [cache.key('parse', job[0]) for job in batch]
+                else: # coordinates of the persons depend on the layout
+                    keys = [cache.key('parse', (layout.offsets, job[0])) for job in batch]
+                for num, job in enumerate(batch):
+                    blocks[num] = rebase_block(cache.get(keys[num]), job[1], job[3])
+            todo = [num for num, persons in enumerate(blocks) if persons is None]
+            todo_jobs = [batch[num] for num in todo]
+
+            if executor is not None and len(todo_jobs) > 1:
+                chunksize = max(1, len(todo_jobs) // (max(1, workers) * 4))
+                parsed = executor.map(job_function, todo_jobs, chunksize=chunksize)
+            else:
+                parsed = map(job_function, todo_jobs)
+
+            for num, persons in zip(todo, parsed):
+                if cache is not None:
+                    persons, logged = persons
+                    cache.put(keys[num], (batch[num][1], persons, logged))
+                blocks[num] = persons
+            parsed_count += len(todo)
+            cached_count += len(batch) - len(todo)
+
+            for persons in blocks:
+                for person in persons:
+                    person['person_id'] = person_id
                     person_id += 1
-                    person_num += 1
-                except Exception as err:
-                    logger.error('Error while parsing persons: %s', err)
+                    # check whether p_old == p
+                    if not mismatch and person['p'] != person['p_raw']:
+                        mismatch = True
+                        logger.warning('P numbering mismatch at %s',
+                                       (person['p'], person['p_raw']))
+                    yield person
+    finally:
+        if own_executor and executor is not None:
+            executor.shutdown()
+    if cache is not None:
+        logger.info('Blocks parsed: %s, from cache: %s', parsed_count, cached_count)
+
+
+def parse_block(block, origin, p_raw=None, p=None, person_id=1, layout=None):
+    """Parse all persons of one numbered block (rows of an A-slot)
+       starting at `origin` Coord, a person per name slot of the block"""
+    b_slots = get_row_slots(block, NAME)
+    name_col = sheet_column(layout, NAME)
+    persons = []
+    person_num = 1
+    for b_start, b_end, b_value in b_slots:
+        try:
+            rows = block[b_start:b_end + 1]
+            person_origin = origin.shift(0, b_start)
+            persons.append(records.Person(
+                p_raw=p_raw,
+                p=p,
+                person_id=person_id,
+                person_num=person_num,
+                start=str(person_origin.shift(name_col)),
+                end=str(origin.shift(name_col, b_end)),
+                name=b_value,
+                position=rows[0][POSITION],
+                income=rows[0][INCOME],
+                ownership=ownership_from_rows(rows, person_origin, layout),
+                usage=usage_from_rows(rows, person_origin, layout),
+                vehicle=vehicle_from_rows(rows, person_origin, layout)
+                ))
+            person_id += 1
+            person_num += 1
+        except Exception as err:
+            logger.error('Error while parsing persons: %s', err)
+    return persons
+
+
+def parse_block_job(job):
+    """parse_block for a (block, origin, p_raw, p, layout) job,
+       person_id is set when merging, see parse_rows"""
+    block, origin, p_raw, p, layout = job
+    return parse_block(block, origin, p_raw=p_raw, p=p, layout=layout)
 
-    # check whether p_old == p
-    ps_generated = [parsed_persons[i]['p'] for i in range(len(parsed_persons))]
-    ps_from_file = [parsed_persons[i]['p_raw'] for i in range(len(parsed_persons))]
-    check_result = check_lists_mismatch(ps_generated, ps_from_file)
-    if check_result:
-        logger.warning('P numbering mismatch at %s', check_result)
-    return parsed_persons
+
+class RecordCapture(logging.Handler):
+    """Keeps (levelno, msg, args) of the records logged by the thread
+       that created it, see captured_block_job"""
+
+    def __init__(self):
+        super().__init__()
+        self.thread = threading.get_ident()
+        self.records = []
+
+    def emit(self, record):
+        if record.thread != self.thread:
+            return
+        if isinstance(record.args, tuple):
+            args = tuple(arg if isinstance(arg, Coord) else str(arg) for arg in record.args)
+            self.records.append((record.levelno, record.msg, args))
+        else:
+            self.records.append((record.levelno, record.getMessage(), ()))
+
+
+# Placeholder of a value of the person in the records kept by map_block
+PersonField = namedtuple('PersonField', ['name'])
+
+
+def captured_block_job(job):
+    """(persons, records) of parse_block_job, records being those logged
+       while parsing, to be logged again when the block is taken from the
+       cache, see rebase_block"""
+    capture = RecordCapture()
+    logger.addHandler(capture)
+    try:
+        persons = parse_block_job(job)
+    finally:
+        logger.removeHandler(capture)
+    return persons, capture.records
+
+
+def rebase_block(entry, origin, p):
+    """Persons of a cached (origin, persons, records) block entry moved to
+       `origin` and `p`, None if there is no entry. The records logged
+       while the block was parsed are logged again, moved as well"""
+    if entry is None:
+        return None
+    cached_origin, persons, logged = entry
+    rows, cols = origin.row - cached_origin.row, origin.col - cached_origin.col
+    for person in persons:
+        person['p'] = p
+        if rows or cols:
+            person['start'] = str(Coord.parse(person['start']).shift(cols, rows))
+            person['end'] = str(Coord.parse(person['end']).shift(cols, rows))
+    for level, msg, args in logged:
+        logger.log(level, msg, *(arg.shift(cols, rows) if isinstance(arg, Coord) else arg
+                                 for arg in args))
+    return persons
+
+
+def sheet_column(layout, index):
+    """Offset from the numbering column of the sheet column holding the
+       value `index` of a canonical row, `layout` None being the canonical one"""
+    return index if layout is None else layout.column(index)
 
 
 def check_lists_mismatch(list_a, list_b):
@@ -182,146 +875,133 @@ def check_lists_mismatch(list_a, list_b):
             return a, b
 
 
+def not_false_empty(val):
+    """Check whether cell.value is not false empty, e.g. ' ' or '  -  '"""
+    empty_values = ['-', ' ', '', None]
+    if type(val).__name__ in ('str', 'unicode'):
+        val = " ".join(val.lower().split()) # catch ' -', ' не  имеет '...
+    return bool(val not in empty_values)
+
+
+def find_slots(values):
+    """Find the slots of a column of `values`. A slot is (first, last, value)
+       offsets, lasting till the next non-empty value. The slot starts are
+       found in one map/compress pass over the column, which still calls
+       not_false_empty once per cell"""
+    size = len(values)
+    starts = list(compress(range(size), map(not_false_empty, values)))
+    ends = [nxt - 1 for nxt in islice(starts, 1, None)] + [size - 1]
+    return [(start, end, values[start]) for start, end in zip(starts, ends)]
+
+
+def get_row_slots(rows, index):
+    """Slots of column `index` of `rows` as (first, last, value) row offsets,
+       a slot lasting till the next non-empty value"""
+    return find_slots([row[index] for row in rows])
+
+
 def get_slot(start, end):
-    """Given /start/ and /end/ coordinates of a range, get all slots,
-       i.e. assumed range till the next slot"""
-    def not_false_empty(val):
-        """Check whether cell.value is not false empty, e.g. ' ' or '  -  '"""
-        empty_values = ['-', ' ', '', None]
-        if type(val).__name__ in ('str', 'unicode'):
-            val = " ".join(val.lower().split()) # catch ' -', ' не  имеет '...
-        return bool(val not in empty_values)
-
-    data = []
-    data_cache = {}
-    for row in ws[start:end]:
-        for cell in row:
-            if not_false_empty(cell.value):
-                if data_cache:
-                    data.append(data_cache)
-                    data_cache = {}
-                    data_cache['start'] = cell.coordinate
-                    data_cache['value'] = cell.value
-                    data_cache['end'] = cell.coordinate
-                    #continue
-                    break
-                else:
-                    data_cache['start'] = cell.coordinate
-                    data_cache['value'] = cell.value
-                    data_cache['end'] = cell.coordinate
-                    #continue
-                    break
-            else:
-                if data_cache:
-                    data_cache['end'] = cell.coordinate
-                else:
-                    #continue
-                    break
-    # check for remaining in cache
-    if data_cache:
-        data.append(data_cache)
-        data_cache = {}
-    return data
+    """Parser.get_slot of `ws`"""
+    return Parser(ws).get_slot(start, end)
 
 
 def shift_col(col, step=1):
-    """Return shifter column index
-       FIXME: Support for AA, GB indeces"""
-    a_z = range(ord('A'), ord('Z') +1)
-    col_letter_ordinal = ord(col[:1]) + step
-    col_num = col[1:]
-    if col_letter_ordinal in a_z:
-        shifted_col = chr(col_letter_ordinal) + col_num
-        return shifted_col
-    elif col_letter_ordinal > 90:
-        logger.error("Can't shift '%s' behind 'Z%s'", col, col_num)
-    else:
-        logger.error('Column "%s" not in A-Z range', col)
+    """Return shifter column index"""
+    shifted = Coord.parse(col).shift(step)
+    if shifted.col < 1:
+        logger.error("Can't shift '%s' before 'A%s'", col, shifted.row)
+        return None
+    return str(shifted)
 
 
-def parse_ownership(person_slot):
-    """person_slot is dict"""
+def slot_rows(person_slot):
+    """Parser.slot_rows of `ws`"""
+    return Parser(ws).slot_rows(person_slot)
+
+
+def ownership_from_rows(rows, origin, layout=None):
+    """Slice 'own_*' columns out of declaration rows"""
     ownership_list = []
-    start = shift_col(person_slot['start'], 3)
-    end = shift_col(person_slot['end'], 3)
-    for row in ws[start:end]:
-        for cell in row:
-            coord = cell.coordinate
-            if cell.value:
-                ownership_list.append({
-                    'own_obj':cell.value,
-                    'own_type':ws[shift_col(coord, 1)].value,
-                    'own_sq':ws[shift_col(coord, 2)].value,
-                    'own_location':ws[shift_col(coord, 3)].value
-                    })
-            elif not cell.value and ws[shift_col(coord)].value not in ['-', None]:
-                # checking whether cell to the right is not empty
-                logger.warning('Value missing: %s?', coord)
-                ownership_list.append({
-                    'own_obj': 'иное', # cell.value to dafult
-                    'own_type':ws[shift_col(coord, 1)].value,
-                    'own_sq':ws[shift_col(coord, 2)].value,
-                    'own_location':ws[shift_col(coord, 3)].value
-                    })
-            else:
-                #logger.debug('Line "{0}" empty'.format(coord[1:]))
-                pass
+    for num, row in enumerate(rows):
+        own_obj, own_type, own_sq, own_location = row[OWNERSHIP]
+        if own_obj:
+            ownership_list.append(records.Ownership(
+                own_obj=own_obj,
+                own_type=own_type,
+                own_sq=own_sq,
+                own_location=own_location
+                ))
+        elif own_type not in ['-', None]:
+            # checking whether cell to the right is not empty
+            logger.warning('Value missing: %s?', origin.shift(sheet_column(layout, OWNERSHIP.start), num))
+            ownership_list.append(records.Ownership(
+                own_obj='иное', # cell.value to dafult
+                own_type=own_type,
+                own_sq=own_sq,
+                own_location=own_location
+                ))
     return ownership_list
 
 
-def parse_usage(person_slot):
-    """Parse 'use_*' columns"""
+def usage_from_rows(rows, origin, layout=None):
+    """Slice 'use_*' columns out of declaration rows"""
     usage_list = []
-    start = shift_col(person_slot['start'], 7)
-    end = shift_col(person_slot['end'], 7)
-    for row in ws[start:end]:
-        for cell in row:
-            coord = cell.coordinate
-            if cell.value:
-                usage_list.append({
-                    'use_obj':cell.value,
-                    'use_sq': ws[shift_col(coord, 1)].value,
-                    'use_loc':ws[shift_col(coord, 2)].value
-                    })
-            elif not cell.value and ws[shift_col(coord)].value not in ['-', None]:
-                logger.info('Value missing: %s?', coord)
-                usage_list.append({
-                    'use_obj': 'иное',#cell.value,
-                    'use_sq': ws[shift_col(coord, 1)].value,
-                    'use_loc':ws[shift_col(coord, 2)].value
-                    })
-            else:
-                pass
-                #logger.debug('Line "{0}" empty'.format(coord[1:]))
+    for num, row in enumerate(rows):
+        use_obj, use_sq, use_loc = row[USAGE]
+        if use_obj:
+            usage_list.append(records.Usage(
+                use_obj=use_obj,
+                use_sq=use_sq,
+                use_loc=use_loc
+                ))
+        elif use_sq not in ['-', None]:
+            logger.info('Value missing: %s?', origin.shift(sheet_column(layout, USAGE.start), num))
+            usage_list.append(records.Usage(
+                use_obj='иное',#cell.value,
+                use_sq=use_sq,
+                use_loc=use_loc
+                ))
     return usage_list
 
 
-def parse_vehicle(person_slot):
-    """Parse 'vehicle_*' columns"""
+def vehicle_from_rows(rows, origin, layout=None):
+    """Slice 'vehicle_*' columns out of declaration rows"""
     vehicle_list = []
-    start = shift_col(person_slot['start'], 10)
-    end = shift_col(person_slot['end'], 10)
-    for row in ws[start:end]:
-        for cell in row:
-            coord = cell.coordinate
-            if cell.value:
-                vehicle_list.append({
-                    'vehicle_item':cell.value,
-                    'vehicle_pay':ws[shift_col(coord, 1)].value
-                    })
-            elif not cell.value and ws[shift_col(coord)].value not in ['-', None]:
-                logger.warning('Value missing at %s?', coord)
-            else:
-                pass
+    for num, row in enumerate(rows):
+        vehicle_item, vehicle_pay = row[VEHICLE]
+        if vehicle_item:
+            vehicle_list.append(records.Vehicle(
+                vehicle_item=vehicle_item,
+                vehicle_pay=vehicle_pay
+                ))
+        elif vehicle_pay not in ['-', None]:
+            logger.warning('Value missing at %s?', origin.shift(sheet_column(layout, VEHICLE.start), num))
     return vehicle_list
 
 
+def parse_ownership(person_slot):
+    """Parser.parse_ownership of `ws`"""
+    return Parser(ws).parse_ownership(person_slot)
+
+
+def parse_usage(person_slot):
+    """Parser.parse_usage of `ws`"""
+    return Parser(ws).parse_usage(person_slot)
+
+
+def parse_vehicle(person_slot):
+    """Parser.parse_vehicle of `ws`"""
+    return Parser(ws).parse_vehicle(person_slot)
+
+
 ################################
 # Modify collected data
 ################################
 
-def map_data(person_data):
-    """Transfers/maps data from a dict to an OrderedDict"""
+def map_data(person_data, lookup=None):
+    """Transfers/maps data from a parsed person to a records.MappedPerson,
+       codes taken from `lookup`, the one of `context` by default"""
+    code = (lookup or context.lookup).code
     name = set_name(person_data)
     #relationType = None
     position = set_position(person_data)
@@ -329,29 +1009,29 @@ def map_data(person_data):
     for realty in person_data['ownership']: # in ownership
         if not_empty(realty['own_obj']):
             own_type, own_part = set_ownership(realty)
-            realty_data = OrderedDict()
+            realty_data = records.Realty()
             #realty_data['realtyType_'] = 'В собственности'
             realty_data['realtyType'] = '1'
             #realty_data['objectType_'] = realty['own_obj']
-            realty_data['objectType'] = value_from_dict(realty['own_obj'], 'objectType')
+            realty_data['objectType'] = code(realty['own_obj'], 'objectType')
             #realty_data['ownershipType_'] = own_type
-            realty_data['ownershipType'] = value_from_dict(own_type, 'ownershipType')
+            realty_data['ownershipType'] = code(own_type, 'ownershipType')
             realty_data['ownershipPart'] = own_part
             realty_data['square'] = realty['own_sq']
             #realty_data['country_num'] = realty['own_location']
-            realty_data['country'] = value_from_dict(realty['own_location'], 'country')
+            realty_data['country'] = code(realty['own_location'], 'country')
             realties.append(realty_data)
         else:
             logger.debug('OWN_OBJ EMPTY: %s', realty['own_obj'])
     for realty in person_data['usage']: # in use
         if not_empty(realty['use_obj']):
-            realty_data = OrderedDict()
+            realty_data = records.Realty()
             realty_data['realtyType'] = '2' # in use:2
             #realty_data['realtyType_'] = 'В пользовании'
-            realty_data['objectType'] = value_from_dict(realty['use_obj'], 'objectType')
+            realty_data['objectType'] = code(realty['use_obj'], 'objectType')
             realty_data['square'] = realty['use_sq']
             #realty_data['country'] = realty['use_loc']
-            realty_data['country'] = value_from_dict(realty['use_loc'], 'country')
+            realty_data['country'] = code(realty['use_loc'], 'country')
             realties.append(realty_data)
         else:
             logger.debug('"USE_OBJ EMPTY: %s', realty['use_obj'])
@@ -360,22 +1040,22 @@ def map_data(person_data):
 
     for transport in person_data['vehicle']:
         if not_empty(transport['vehicle_item']):
-            transports.append(OrderedDict({
-                'transportName':transport['vehicle_item']
-                }))
+            transports.append(records.Transport(
+                transportName=transport['vehicle_item']
+                ))
         else:
             logger.debug('TRANSPORT EMPTY: %s', transport['vehicle_item'])
     income = set_income(person_data)
     income_comment = None # disabled
     income_source = None # disabled
 
-    pers = OrderedDict()
+    pers = records.MappedPerson()
     pers['id'] = person_data['person_id']
     #pers['p'] = person_data['p']
     #pers['p_raw'] = person_data['p_raw']
     pers['name'] = name
     pers['relativeOf'] = person_data['relativeOf']
-    pers['relationType'] = value_from_dict(person_data['relationType'], 'relationType')
+    pers['relationType'] = code(person_data['relationType'], 'relationType')
     pers['position'] = position
 
     if realties:
@@ -394,6 +1074,75 @@ def map_data(person_data):
     return pers
 
 
+def dictionaries_digest():
+    """Hash of the loaded dictionaries, mapped blocks depend on them"""
+    return context.digest()
+
+
+def shift_ids(mapped_persons, offset):
+    """Copies of mapped persons with `id` and `relativeOf` moved by `offset`"""
+    shifted = []
+    for pers in mapped_persons:
+        pers = pers.copy()
+        pers['id'] += offset
+        if pers['relativeOf'] is not None:
+            pers['relativeOf'] += offset
+        shifted.append(pers)
+    return shifted
+
+
+def map_block(block, cache=None, context=None):
+    """map_data for every person of a block with the dictionaries of
+       `context`, the process one by default.
+       With a `cache` (xcache.BlockCache) a block already mapped in an earlier
+       run is reused, its ids moved to the block's person_id, its lookup
+       misses counted again and the records logged while mapping it logged
+       again, with the `p` and `start` of the persons now"""
+    if context is None:
+        context = process_context()
+    lookup = context.lookup
+    if cache is None:
+        return [map_data(person, lookup) for person in block]
+
+    base = block[0]['person_id'] - 1
+    relative_block = []
+    for person in block:
+        person = {k: v for k, v in person.items() if k not in ('p', 'start', 'end')}
+        person['person_id'] -= base
+        if person['relativeOf'] is not None:
+            person['relativeOf'] -= base
+        relative_block.append(sorted(person.items(), key=lambda item: item[0]))
+    key = cache.key('map', (context.digest(), lookup.fuzzy, relative_block))
+
+    entry = cache.get(key)
+    if entry is not None:
+        mapped, misses, logged = entry
+        lookup.add_misses(misses)
+        for num, level, msg, args in logged:
+            logger.log(level, msg, *(block[num][arg.name] if isinstance(arg, PersonField) else arg
+                                     for arg in args))
+        return shift_ids(mapped, base)
+    counted = lookup.take_misses()
+    capture = RecordCapture()
+    logger.addHandler(capture)
+    mapped, logged = [], []
+    try:
+        for num, person in enumerate(block):
+            mapped.append(map_data(person, lookup))
+            # p and start are not in the key, they are filled in when logged again
+            fields = {str(person['p']): PersonField('p'), str(person['start']): PersonField('start')}
+            logged.extend((num, level, msg, tuple(fields.get(arg, arg) for arg in args))
+                          for level, msg, args in capture.records)
+            capture.records = []
+    finally:
+        logger.removeHandler(capture)
+    misses = lookup.take_misses()
+    lookup.add_misses(counted)
+    lookup.add_misses(misses)
+    cache.put(key, (shift_ids(mapped, -base), misses, logged))
+    return mapped
+
+
 def set_name(person_data):
     """If relativeOf, set name=None, else name"""
     types_of_relatives = ['супруг',
@@ -464,26 +1213,26 @@ def set_income(person_data):
 
 def get_p(all_data):
     """Get respective p"""
-    last = all_data[-1]['person_id'] # 1-99
-    blocks = []
-    for i in range(last):
-        b = all_data[i]['p']
-        if b not in blocks:
-            blocks.append(b)
-    return blocks
+    return list(dict.fromkeys(person['p'] for person in all_data))
 
 
 def make_blocks(data):
     """Divide into blocks according to `main person`"""
-    blocks = []
-    for num in get_p(data):
-        block = [b for b in data if b['p'] == num]
-        blocks.append(block)
-    return blocks
+    blocks = OrderedDict()
+    for person in data:
+        blocks.setdefault(person['p'], []).append(person)
+    return list(blocks.values())
 
 
-def set_relations(blocks_by_person):
-    """Add relationship information to every person in every block"""
+def iter_blocks(data):
+    """Yield blocks of persons with common 'p' one by one, in a single pass.
+       Persons of a block have to be adjacent, as parse_person returns them"""
+    for _, block in groupby(data, key=itemgetter('p')):
+        yield list(block)
+
+
+def iter_related(blocks_by_person):
+    """Yield blocks with relationship information added to every person"""
     for block in blocks_by_person:
         main = block[0]['person_id']
         for person in block:
@@ -493,6 +1242,13 @@ def set_relations(blocks_by_person):
             else:
                 person['relativeOf'] = main
                 person['relationType'] = person['name']
+        yield block
+
+
+def set_relations(blocks_by_person):
+    """Add relationship information to every person in every block"""
+    for _ in iter_related(blocks_by_person):
+        pass
 
 
 
@@ -500,13 +1256,66 @@ def set_relations(blocks_by_person):
 # Load and save data
 ##########################
 
-def load_file(xls_file):
-    """Loading file"""
+ValueCell = namedtuple('ValueCell', ['coordinate', 'value']) #pylint: disable=invalid-name
+
+
+class ValueSheet(object):
+    """Values-only stand-in for a worksheet, filled row by row from a
+       read-only workbook. Supports the part of the worksheet API the
+       parser uses: ws['B2'], ws['B2':'B9'] and iter_rows(values_only=True)"""
+
+    def __init__(self, rows, title=None):
+        self.rows = [tuple(row) for row in rows]
+        self.title = title
+        self.max_row = len(self.rows)
+        self.max_column = max([len(row) for row in self.rows] or [0])
+
+    def value(self, row, col):
+        """Cell value by 1-based row and column, None outside of the data"""
+        try:
+            return self.rows[row - 1][col - 1]
+        except IndexError:
+            return None
+
+    def cell(self, coord):
+        """Cell at `coord`"""
+        position = Coord.parse(coord)
+        return ValueCell(coord, self.value(*position))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end = Coord.parse(key.start), Coord.parse(key.stop)
+            return tuple(
+                tuple(ValueCell(str(Coord(row, col)), self.value(row, col))
+                      for col in range(start.col, end.col + 1))
+                for row in range(start.row, end.row + 1))
+        return self.cell(key)
+
+    def iter_rows(self, min_row=None, max_row=None, min_col=None, max_col=None,
+                  values_only=True):
+        """Yield row tuples of values"""
+        min_row = min_row or 1
+        max_row = max_row or self.max_row
+        min_col = min_col or 1
+        max_col = max_col or self.max_column
+        for row in range(min_row, max_row + 1):
+            yield tuple(self.value(row, col) for col in range(min_col, max_col + 1))
+
+
+def load_file(xls_file, read_only=False, max_col=None):
+    """Loading file.
+       With `read_only` the workbook is streamed row by row and only the cell
+       values (up to `max_col`) are kept, see ValueSheet"""
+    import openpyxl # pylint: disable=import-outside-toplevel
     try:
         logger.info('Loading data from %s...', xls_file)
-        workbook = openpyxl.load_workbook(xls_file, read_only=False)
+        workbook = openpyxl.load_workbook(xls_file, read_only=read_only)
         worksheet_name = workbook.sheetnames[0]
         worksheet = workbook[worksheet_name]
+        if read_only:
+            worksheet = ValueSheet(worksheet.iter_rows(max_col=max_col, values_only=True),
+                                   title=worksheet_name)
+            workbook.close()
         logger.info('Data loaded.')
     except Exception as err:
         logger.error('Error (%s) loading file: %s', err, xls_file)
@@ -522,18 +1331,109 @@ def parent_to_child(parent_name):
         return parents[parent_name]
 
 
-def save_to_file(blocks_of_data, split_at=0, save_dir='out'):
-    """"Iterate over a list of blocks with common 'p' and save to .xml
-    FIXME: add leading zeros to file names"""
-    def save(input_data, sdir, output_xml):
-        """xml -> file.xml"""
-        xml_data = dicttoxml2.dict2xml(input_data,
+# xml writers of save_to_file: generic dicttoxml3 or the persons schema one
+WRITERS = ('schema', 'generic')
+
+
+def open_writer(path, serializer='schema'):
+    """Writer of mapped persons to a partial file of `path`, named after
+       the process so that writers of the same path do not clash, see
+       close_writer and WRITERS"""
+    fileobj = open('%s.%s.part' % (path, os.getpid()), 'wb', buffering=2**16)
+    if serializer == 'generic':
+        return dicttoxml3.StreamWriter(fileobj,
                                        attr_type=False,
                                        item_func=parent_to_child,
                                        custom_root='persons')
-        with open(sdir + os.sep + output_xml, 'wb') as f:
-            f.write(xml_data)
+    return xschema.SchemaWriter(fileobj,
+                                item_func=parent_to_child,
+                                custom_root='persons')
+
+
+def close_writer(writer, path):
+    """Close the partial file and rename it to `path`"""
+    writer.close()
+    os.replace(writer.fileobj.name, path)
+
+
+def save_chunk(job):
+    """Map and write the blocks of a (blocks, save_dir, file_name, cache,
+       serializer, mapped, context) job to one file. Return the number of
+       persons and the lookup misses of the mapping, see Lookup.take_misses"""
+    blocks, save_dir, file_name, cache, serializer, mapped, job_context = job
+    lookup = job_context.lookup
+    counted = lookup.take_misses()
+    path = save_dir + os.sep + file_name
+    writer = open_writer(path, serializer)
+    persons_count = 0
+    for block in blocks:
+        for p in (block if mapped else map_block(block, cache, job_context)):
+            writer.write(p)
+            persons_count += 1
+    close_writer(writer, path)
+    misses = lookup.take_misses()
+    lookup.add_misses(counted)
+    lookup.add_misses(misses)
+    return persons_count, misses
+
+
+def save_chunks(blocks_of_data, split_at, save_dir, cache, serializer, workers, mapped=False,
+                executor=None, context=None):
+    """Every `split_at` blocks are mapped and written to their file by one of
+       `workers` processes, of `executor` if given, at most two chunks per
+       worker are held at a time. The `context`, the process one by default,
+       is sent with every chunk, so workers map alike however they are
+       started (fork, spawn, forkserver). The lookup misses of the workers
+       are counted in this process. Return (blocks_count, persons_count)"""
+    if context is None:
+        context = process_context()
+    lookup = context.lookup
+    blocks_of_data = iter(blocks_of_data)
+    blocks_count = 0
+    persons_count = 0
+    pending = deque()
+
+    def collect(future):
+        """Persons of a save_chunk `future`, its misses counted"""
+        count, misses = future.result()
+        lookup.add_misses(misses)
+        return count
 
+    own_executor = executor is None
+    if own_executor:
+        executor = process_pool(workers)
+    try:
+        while True:
+            chunk = list(islice(blocks_of_data, split_at))
+            if not chunk:
+                break
+            file_name = 'persons-%s-%s.xml' % (blocks_count + 1, blocks_count + len(chunk))
+            blocks_count += len(chunk)
+            pending.append(executor.submit(save_chunk, (chunk, save_dir, file_name, cache,
+                                                        serializer, mapped, context)))
+            if len(pending) >= 2 * workers:
+                persons_count += collect(pending.popleft())
+        for future in pending:
+            persons_count += collect(future)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return blocks_count, persons_count
+
+
+def save_to_file(blocks_of_data, split_at=0, save_dir='out', cache=None,
+                 serializer='schema', workers=0, mapped=False, executor=None, context=None):
+    """"Iterate over a list of blocks with common 'p' and save to .xml,
+    mapped with the dictionaries of `context`, the process one by default.
+    Mapped blocks are reused from `cache` if given, see map_block.
+    `serializer` is one of WRITERS, all of them give the same xml.
+    Every person is written as soon as it is mapped, the file gets its
+    final name when complete. With `split_at` and `workers` > 1 the
+    files are written by a process pool, `executor` if given, see save_chunks.
+    With `mapped` the blocks are of mapped persons already, see xcolumns
+    FIXME: add leading zeros to file names"""
+    if serializer not in WRITERS:
+        raise ValueError('Unknown serializer %s' % serializer)
     #if type(split_at) != type(2):
     if not isinstance(split_at, int):
         split_at = 0
@@ -548,33 +1448,41 @@ def save_to_file(blocks_of_data, split_at=0, save_dir='out'):
     except Exception as err:
         logger.error('%s. Couldn\'t create directory', err)
 
+    if split_at > 0 and workers > 1:
+        blocks_count, persons_count = save_chunks(blocks_of_data, split_at, save_dir,
+                                                  cache, serializer, workers, mapped,
+                                                  executor, context)
+        logger.info('Total blocks in XML: %s / persons: %s.', blocks_count, persons_count)
+        return blocks_count, persons_count
+
     blocks_count = 0
     persons_count = 0
-    persons_list = []
+    writer = None
 
     for block in blocks_of_data:
+        if writer is None:
+            writer = open_writer(save_dir + os.sep + 'persons.xml', serializer)
         blocks_count += 1
-        for person in block:
-            p = map_data(person)
-            persons_list.append(p)
+        for p in (block if mapped else map_block(block, cache, context)):
+            writer.write(p)
             persons_count += 1
 
         if split_at > 0 and blocks_count % split_at == 0:
             file_num = str(blocks_count + 1 - split_at) + '-' + str(blocks_count)
             file_name = 'persons-' + file_num + '.xml'
-            save(persons_list, save_dir, file_name)
-            persons_list = []
+            close_writer(writer, save_dir + os.sep + file_name)
+            writer = None
 
-    if persons_list:
+    if writer is not None:
         if split_at > 0:
             file_num = str(blocks_count - (blocks_count % split_at) + 1) + '-' + str(blocks_count)
             file_name = 'persons-' + file_num + '.xml'
         if split_at == 0:
             file_num = str(blocks_count)
             file_name = 'persons-' + file_num + '.xml'
-        save(persons_list, save_dir, file_name)
+        close_writer(writer, save_dir + os.sep + file_name)
     logger.info('Total blocks in XML: %s / persons: %s.', blocks_count, persons_count)
-
+    return blocks_count, persons_count
 
 
 if __name__ == '__main__':
@@ -585,7 +1493,8 @@ if __name__ == '__main__':
     parser.add_argument("xls_file",
                         help="Input xls file")
     parser.add_argument("-c", "--column_range",
-                        help="Persons column range - parse persons from Ax to Axxx",
+                        help="Persons column range - parse persons from Ax to Axxx, "
+                        "detected if omitted",
                         type=str)
     parser.add_argument("-s", "--split_at",
                         help="Split output xml file into N blocks each",
@@ -594,21 +1503,77 @@ if __name__ == '__main__':
     parser.add_argument("-t", "--save_dir",
                         help="Directory to save files to",
                         type=str, default='out')
+    parser.add_argument("-w", "--workers",
+                        help="Parse person blocks and write split files in N processes",
+                        type=int,
+                        default=0)
+    parser.add_argument("-r", "--read_only",
+                        help="Stream the workbook in read-only mode, in roughly constant memory",
+                        action="store_true")
+    parser.add_argument("--no-cache", "--no_cache",
+                        help="Do not reuse or store parsed blocks",
+                        dest="no_cache",
+                        action="store_true")
+    parser.add_argument("--cache_dir",
+                        help="Directory of the parsed blocks cache",
+                        type=str, default='.xparse_cache')
+    parser.add_argument("-f", "--fuzzy",
+                        help="Match unknown object/ownership types, countries and relations "
+                        "to dictionary entries within N edits",
+                        type=int,
+                        default=0)
+    parser.add_argument("-l", "--log_level",
+                        help="Log messages of this level and above: DEBUG, INFO, WARNING, ERROR",
+                        type=str, default='INFO')
+    parser.add_argument("--log_file",
+                        help="File to log to as well, empty for none",
+                        type=str, default='xparse.log')
+    parser.add_argument("--log_limit",
+                        help="Log at most N messages of a kind below ERROR, 0 for all",
+                        type=int, default=10)
+    parser.add_argument("--layout",
+                        help="Column layout: a profile name (see layouts/) or a JSON file, "
+                        "selected by the header if omitted",
+                        type=str)
+    parser.add_argument("--serializer",
+                        help="XML writer: schema (default) or generic dicttoxml",
+                        choices=WRITERS,
+                        default='schema')
     ARGS = parser.parse_args()
+    xlog.setup_logging(ARGS.log_level, ARGS.log_file, ARGS.log_limit)
 
     #test_get_slot('C2', 'C9')
     #test_parse_person('A2', 'A39')
-    #ws = load_file('data/book_101.xlsx')
     #data_all = parse_person('A2:A787')
 
-    if validate_dimensions(ARGS.column_range):
-        logger.info('Dimensions valid.')
+    if ARGS.column_range is None or validate_dimensions(ARGS.column_range):
+        if ARGS.column_range:
+            logger.info('Dimensions valid.')
         try:
-            ws = load_file(ARGS.xls_file)
-            data_all = parse_person(ARGS.column_range)
-            blocks_by_p = make_blocks(data_all)
-            set_relations(blocks_by_p)
-            save_to_file(blocks_by_p, ARGS.split_at, ARGS.save_dir)
+            cache = None if ARGS.no_cache else xcache.BlockCache(ARGS.cache_dir)
+            context.lookup.set_fuzzy(ARGS.fuzzy)
+            # one pool of -w processes parses the blocks and writes the files
+            executor = process_pool(ARGS.workers)
+            try:
+                if ARGS.read_only:
+                    persons = iter_parse(ARGS.xls_file, ARGS.column_range, ARGS.workers, cache,
+                                         ARGS.layout, executor)
+                else:
+                    sheet_parser = Parser(load_file(ARGS.xls_file, False,
+                                                    layout_max_col(ARGS.column_range or 'A2',
+                                                                   ARGS.layout)),
+                                          layout=ARGS.layout)
+                    persons = sheet_parser.iter_persons(ARGS.column_range, ARGS.workers, cache,
+                                                        executor)
+                blocks_by_p = iter_related(iter_blocks(persons))
+                save_to_file(blocks_by_p, ARGS.split_at, ARGS.save_dir, cache,
+                             ARGS.serializer, ARGS.workers, executor=executor)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+            context.lookup.log_misses()
+            if cache is not None:
+                cache.evict()
         except Exception as err:
             logger.error("Something is wrong. %s", err)
     else:
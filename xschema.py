@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; version 3 only.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Xschema writes mapped persons to xml with per-field templates.
+
+A mapped person is a flat record of scalars plus the `realties` and
+`transports` lists of flat records. Every key gets its tags rendered once,
+so a record is written by looking up its keys, not by the generic recursion
+of dicttoxml2. The output is the same as dict2xml(..., attr_type=False)
+gives, for dicts and records alike; values that are not plain str, int, float, None or lists of records
+are handed over to dicttoxml3."""
+
+import io
+from collections.abc import Mapping
+from dicttoxml2 import dicttoxml3
+from dicttoxml2.dicttoxml3 import ESCAPE_TABLE, NIL
+
+
+class Field(object):
+    """Tags of one record key"""
+
+    __slots__ = ('key', 'start', 'end', 'nil', 'item')
+
+    def __init__(self, key, item_func):
+        attr = {}
+        name = dicttoxml3.xml_name(key, attr)
+        self.key = key
+        self.start = '<%s%s>' % (name, dicttoxml3.attrstring(attr))
+        self.end = '</%s>' % (name)
+        self.nil = '<' + name + NIL
+        self.item = item_func(name) # element name of list items
+
+
+class Fields(dict):
+    """Field by key, made on first use"""
+
+    def __init__(self, item_func):
+        super().__init__()
+        self.item_func = item_func
+
+    def __missing__(self, key):
+        field = self[key] = Field(key, item_func=self.item_func)
+        return field
+
+
+class SchemaWriter(object):
+    """Writes mapped persons like dicttoxml3.StreamWriter with attr_type=False
+    does, one person at a time.
+    Usage:
+        writer = SchemaWriter(fileobj, custom_root='persons', item_func=...)
+        for person in persons:
+            writer.write(person)
+        writer.close()
+    """
+
+    def __init__(self, fileobj, custom_root='persons', item_func=dicttoxml3.default_item_func):
+        self.fileobj = fileobj
+        self.custom_root = custom_root
+        self.item_func = item_func
+        self.item_name = item_func(custom_root)
+        self.fields = Fields(item_func)
+        self.fileobj.write((dicttoxml3.XML_DECLARATION +
+                            dicttoxml3.XSI_ROOT % (custom_root)).encode('utf-8'))
+
+    def add_record(self, out, record):
+        """Appends the fields of a flat record"""
+        append = out.append
+        fields = self.fields
+        for key, val in record.items():
+            field = fields[key]
+            val_type = type(val)
+            if val_type is str:
+                append(field.start + val.translate(ESCAPE_TABLE) + field.end)
+            elif val is None:
+                append(field.nil)
+            elif val_type is int or val_type is float:
+                append(field.start + str(val) + field.end)
+            elif val_type is list and all(isinstance(item, Mapping) for item in val):
+                self.add_records(out, field, val)
+            else:
+                dicttoxml3.add_dict(out, {key: val}, False, None, False, self.item_func, False)
+
+    def add_records(self, out, field, records):
+        """Appends a list of flat records"""
+        start, end = '<%s>' % (field.item), '</%s>' % (field.item)
+        out.append(field.start)
+        for record in records:
+            out.append(start)
+            self.add_record(out, record)
+            out.append(end)
+        out.append(field.end)
+
+    def render(self, person):
+        """Xml of a person"""
+        if not isinstance(person, Mapping):
+            out = []
+            dicttoxml3.add_list(out, [person], False, self.custom_root, False,
+                                self.item_func, False)
+            return ''.join(out)
+        out = ['<%s>' % (self.item_name)]
+        self.add_record(out, person)
+        out.append('</%s>' % (self.item_name))
+        return ''.join(out)
+
+    def write(self, person):
+        """Converts one person and writes it"""
+        self.fileobj.write(self.render(person).encode('utf-8'))
+
+    def close(self):
+        """Writes the closing root tag and closes the file"""
+        self.fileobj.write(('</%s>' % (self.custom_root)).encode('utf-8'))
+        self.fileobj.close()
+
+
+def persons2xml(persons, custom_root='persons', item_func=dicttoxml3.default_item_func):
+    """Whole document of `persons`, as dict2xml(persons, attr_type=False,
+    custom_root=..., item_func=...) returns it"""
+    fileobj = io.BytesIO()
+    writer = SchemaWriter(fileobj, custom_root, item_func)
+    for person in persons:
+        writer.write(person)
+    return fileobj.getvalue() + ('</%s>' % (custom_root)).encode('utf-8')